@@ -0,0 +1,84 @@
+import sys
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+import argparse
+import itertools
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.extract import MEDIA_FORMAT, walk_on_tree
+
+# Время поиска входных видео: прежний обход (path.glob на каждое расширение) против одного прохода os.scandir
+# последовательно и в пуле потоков. Дерево: depth уровней по width директорий, в каждой files файлов,
+# из которых половина - видео (расширения в разном регистре).
+
+
+def legacy_walk(path_list, root_output_dir, recursive=False):
+    glob_pattern = '**/*' if recursive else '*'
+    for path in path_list:
+        if path.is_dir():
+            output_dir = path if root_output_dir is None else root_output_dir
+            yield from ((media, output_dir.joinpath(media.parent.relative_to(path)))
+                        for media in itertools.chain.from_iterable(path.glob(glob_pattern + ext)
+                        for ext in MEDIA_FORMAT))
+
+
+def make_tree(root, depth, width, files):
+    extensions = ('.mp4', '.MP4', '.avi', '.txt', '.jpg', '.json')
+    directories = [root]
+    for _ in range(depth):
+        directories = [directory / 'd{}'.format(i) for directory in directories for i in range(width)]
+        for directory in directories:
+            directory.mkdir(parents=True)
+            for i in range(files):
+                (directory / 'f{}{}'.format(i, extensions[i % len(extensions)])).touch()
+    return len(directories)
+
+
+def measure(walk, *args):
+    start = time.perf_counter()
+    count = sum(1 for _ in walk(*args))
+    return count, time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Скорость поиска входных видео в дереве директорий')
+    parser.add_argument('-d', '--depth', type=int, default=3, action='store', help='Глубина дерева')
+    parser.add_argument('-w', '--width', type=int, default=10, action='store', help='Поддиректорий на уровне')
+    parser.add_argument('-f', '--files', type=int, default=20, action='store', help='Файлов в директории')
+    parser.add_argument('-j', '--jobs', type=int, default=8, action='store', help='Потоков параллельного обхода')
+    parser.add_argument('--root', type=str, action='store',
+                        help='Существующее дерево (например, на сетевой файловой системе) вместо временного')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args['root']:
+            root = Path(args['root']).absolute()
+        else:
+            root = Path(tmp)
+            leaves = make_tree(root, args['depth'], args['width'], args['files'])
+            print('Tree: {} leaf directories, {} files'.format(leaves, leaves * args['files']))
+
+        runs = (
+            ('glob per extension', legacy_walk, ([root], None, True)),
+            ('scandir', walk_on_tree, ([root], None, True)),
+            ('scandir, {} threads'.format(args['jobs']), walk_on_tree, ([root], None, True, (), (), args['jobs'])),
+        )
+        print('{:<24} {:>8} {:>10}'.format('walker', 'media', 'seconds'))
+        for name, walk, walk_args in runs:
+            count, elapsed = measure(walk, *walk_args)
+            print('{:<24} {:>8} {:>10.3f}'.format(name, count, elapsed))
+
+
+if __name__ == "__main__":
+    main()
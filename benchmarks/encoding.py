@@ -0,0 +1,73 @@
+import sys
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+import argparse
+import os
+import subprocess as sp
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.extract import IMAGE_FORMAT, ENCODING_PROFILES, ExtractionTask, extract_all, run_task
+
+# Скорость (кадров в секунду) и размер кадра (байт) для каждого формата и профиля кодирования
+# при извлечении всех кадров синтетического видео.
+
+
+def make_clip(path, size, duration, fps):
+    sp.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi',
+            '-i', 'testsrc2=size={}:rate={}:duration={}'.format(size, fps, duration),
+            '-c:v', 'libx264', '-pix_fmt', 'yuv420p', str(path)], check=True)
+
+
+def measure(clip, root_dir, frame_format, profile, quality):
+    task = ExtractionTask(clip, root_dir, frame_format=frame_format, profile=profile, quality=quality)
+    extract_all(task, True)
+    start = time.perf_counter()
+    if run_task(task) != 0:
+        raise RuntimeError('Extraction failed: {} {}'.format(frame_format, profile))
+    elapsed = time.perf_counter() - start
+
+    with os.scandir(str(task.output_dir)) as entries:
+        sizes = [entry.stat().st_size for entry in entries if entry.name.endswith('.' + frame_format)]
+    return len(sizes) / elapsed, sum(sizes) / max(len(sizes), 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Скорость и размер кадров для форматов и профилей кодирования')
+    parser.add_argument('-s', '--size', type=str, default='1280x720', action='store', help='Размер кадра')
+    parser.add_argument('-d', '--duration', type=int, default=10, action='store', help='Длительность видео (в секундах)')
+    parser.add_argument('--fps', type=int, default=30, action='store', help='Частота кадров')
+    parser.add_argument('--format', type=str, nargs='+', default=list(IMAGE_FORMAT), choices=IMAGE_FORMAT,
+                        action='store', help='Форматы кадров')
+    parser.add_argument('--quality', type=int, nargs='+', default=[], action='store',
+                        help='Дополнительно замерить jpg и webp с этими значениями качества')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = Path(tmp) / 'clip.mp4'
+        make_clip(clip, args['size'], args['duration'], args['fps'])
+
+        runs = [(frame_format, profile, None) for frame_format in args['format'] for profile in ENCODING_PROFILES]
+        runs.extend((frame_format, 'balanced', quality) for frame_format in args['format']
+                    if frame_format in ('jpg', 'webp') for quality in args['quality'])
+
+        print('Clip: {} {} s @ {} fps'.format(args['size'], args['duration'], args['fps']))
+        print('{:<6} {:<9} {:>7} {:>10} {:>14}'.format('format', 'profile', 'quality', 'frames/s', 'bytes/frame'))
+        for i, (frame_format, profile, quality) in enumerate(runs):
+            fps, frame_size = measure(clip, Path(tmp) / str(i), frame_format, profile, quality)
+            print('{:<6} {:<9} {:>7} {:>10.1f} {:>14.0f}'.format(
+                frame_format, profile, '-' if quality is None else quality, fps, frame_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import sys
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+import argparse
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.fileops import native_sort
+
+# Замер прохода переименования, который выполнялся после ffmpeg до того, как кадры стали получать
+# итоговые имена в момент записи (-frame_pts). Старый проход воспроизведен здесь без изменений.
+
+
+def legacy_rename_pass(directory, uid, interval, ext):
+    for img in sorted(directory.glob('{}_*.{}'.format(str(uid), ext)), key=native_sort):
+        prefix, index = img.stem.rsplit('_', maxsplit=1)
+        img.rename(img.parent / '{}{}'.format((int(index) - 1) * interval + 1, img.suffix))
+
+
+def create_frames(directory, names):
+    for name in names:
+        (directory / name).touch()
+
+
+def measure(frames, interval, ext):
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_dir = Path(tmp) / 'legacy'
+        current_dir = Path(tmp) / 'current'
+        legacy_dir.mkdir()
+        current_dir.mkdir()
+        uid = uuid.uuid4()
+
+        start = time.perf_counter()
+        create_frames(legacy_dir, ('{}_{}.{}'.format(str(uid), i, ext) for i in range(1, frames + 1)))
+        legacy_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        legacy_rename_pass(legacy_dir, uid, interval, ext)
+        legacy_rename = time.perf_counter() - start
+
+        start = time.perf_counter()
+        create_frames(current_dir, ('{:08d}.{}'.format(i * interval + 1, ext) for i in range(frames)))
+        current_write = time.perf_counter() - start
+
+        shutil.rmtree(legacy_dir)
+        shutil.rmtree(current_dir)
+
+    return legacy_write, legacy_rename, current_write
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Сравнение переименования кадров после ffmpeg и именования при записи')
+    parser.add_argument('-n', '--frames', type=int, default=216000, action='store',
+                        help='Количество кадров (по умолчанию 2 часа видео с частотой 30 к/с)')
+    parser.add_argument('-f', '--frame_interval', type=int, default=1, action='store', help='Шаг извлечения (в кадрах)')
+    parser.add_argument('--format', type=str, default='png', action='store', help='Расширение файлов кадров')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+
+    legacy_write, legacy_rename, current_write = measure(args['frames'], args['frame_interval'], args['format'])
+
+    print('Frames: {}'.format(args['frames']))
+    print('Legacy:  write {:.3f} s + glob/sort/rename {:.3f} s = {:.3f} s'.format(
+        legacy_write, legacy_rename, legacy_write + legacy_rename))
+    print('Current: write {:.3f} s'.format(current_write))
+    print('Saved:   {:.3f} s ({:.1f} us/frame)'.format(
+        legacy_rename, legacy_rename / max(args['frames'], 1) * 10**6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import sys
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+import argparse
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from natsort import natsorted
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rebase_frames
+
+# Замер rebase_frames.py на сгенерированном дереве: прежний проход (glob по каждому расширению, natsorted,
+# регулярные выражения и mkdir на каждый кадр, последовательные переименования) против текущего
+# (один обход os.scandir, кэш директорий, план перемещений и пул потоков).
+
+time_pattern = re.compile(r"([01]?[0-9]|2[0-3])_([0-5][0-9])_([0-5][0-9])")
+sub_pattern = re.compile(r"(\s?\(\w+\))")
+
+
+def legacy_get_name(image):
+    dirname = image.parent.name
+    pref = image.parent.parent.name.replace('_', '')
+    if pref.startswith('20'):
+        pref = pref[2:]
+    unbracket = re.sub(sub_pattern, '', pref).strip()
+    if len(unbracket) == 6:
+        pref = unbracket
+    match = re.match(time_pattern, dirname)
+    if match is None:
+        return None
+    output_dir = image.parent.parent / "{}_{}".format(pref, match.group(1))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        frame_number = int(image.stem.rsplit('_', maxsplit=1)[-1])
+    except ValueError:
+        filename = "{}_{}_{}".format(pref, dirname.replace('_', ''), image.name)
+    else:
+        filename = "{}_{}_{:0=6}{}".format(pref, dirname.replace('_', ''), frame_number, image.suffix)
+    return output_dir / filename
+
+
+def legacy_rebase(directory):
+    start = time.perf_counter()
+    images = [image for ext in rebase_frames.IMAGE_FORMAT for image in natsorted(directory.glob('**/*' + ext))]
+    scan = time.perf_counter() - start
+    for image in images:
+        name = legacy_get_name(image)
+        if name is not None and not name.exists():
+            image.replace(name)
+    return scan, time.perf_counter() - start
+
+
+def current_rebase(directory, jobs):
+    start = time.perf_counter()
+    moves, exists, skipped, sub_dirs = rebase_frames.plan_moves(directory)
+    scan = time.perf_counter() - start
+    rebase_frames.run_moves(moves, jobs)
+    return scan, time.perf_counter() - start
+
+
+def make_tree(root, files, files_per_dir):
+    """Дерево вида root/ГГГГ_ММ_ДД/ЧЧ_ММ_СС/frame_N.png."""
+    for i in range(0, files, files_per_dir):
+        directory = root / '2020_01_{:02d}'.format(i // files_per_dir // 1000 + 1) / '{:02d}_{:02d}_{:02d}'.format(
+            i // files_per_dir // 60 % 24, i // files_per_dir % 60, 0)
+        directory.mkdir(parents=True, exist_ok=True)
+        for n in range(i, min(i + files_per_dir, files)):
+            (directory / 'frame_{}.png'.format(n)).touch()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Замер rebase_frames.py на сгенерированном дереве кадров')
+    parser.add_argument('-n', '--files', type=int, default=10**6, action='store', help='Количество файлов')
+    parser.add_argument('--files_per_dir', type=int, default=1000, action='store',
+                        help='Количество файлов в директории')
+    parser.add_argument('-j', '--jobs', type=int, default=rebase_frames.MOVE_WORKERS, action='store',
+                        help='Количество потоков перемещения')
+    parser.add_argument('--skip_legacy', action='store_true', help='Не замерять прежний проход')
+    parser.add_argument('--dir', type=str, action='store', help='Директория для дерева (по умолчанию временная)')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args['dir']) as tmp:
+        runs = [('Current', lambda root: current_rebase(root, args['jobs']))]
+        if not args['skip_legacy']:
+            runs.insert(0, ('Legacy', legacy_rebase))
+
+        print('Files: {}, files per directory: {}'.format(args['files'], args['files_per_dir']))
+        for name, rebase in runs:
+            root = Path(tmp) / name
+            start = time.perf_counter()
+            make_tree(root, args['files'], args['files_per_dir'])
+            print('{:<8} tree created in {:.1f} s'.format(name, time.perf_counter() - start))
+            scan, total = rebase(root)
+            print('{:<8} scan {:.2f} s, total {:.2f} s ({:.0f} files/s)'.format(name, scan, total, args['files'] / total))
+            shutil.rmtree(str(root))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import sys
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+import argparse
+import filecmp
+import os
+import subprocess as sp
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.extract import ExtractionTask, extract_by_frame_interval, extract_by_time_interval, run_task
+
+# Проверка параллельного извлечения по отрезкам: кадры синтетического видео извлекаются одним процессом
+# и --segments процессами, затем выходные директории сравниваются покадрово (имена и содержимое файлов).
+# Возвращает 1, если хотя бы один кадр отличается.
+
+
+def make_clip(path, size, duration, fps, gop):
+    sp.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi',
+            '-i', 'testsrc2=size={}:rate={}:duration={}'.format(size, fps, duration),
+            '-c:v', 'libx264', '-g', str(gop), '-pix_fmt', 'yuv420p', str(path)], check=True)
+
+
+def extract(clip, root_dir, segments, frame_intervals, time_intervals):
+    task = ExtractionTask(clip, root_dir, segments=segments)
+    for frame_interval in frame_intervals:
+        extract_by_frame_interval(task, frame_interval)
+    for time_interval in time_intervals:
+        extract_by_time_interval(task, time_interval)
+    start = time.perf_counter()
+    if run_task(task) != 0:
+        raise RuntimeError('Extraction failed: {} segments'.format(segments))
+    return task, time.perf_counter() - start
+
+
+def compare(expected, actual):
+    """Количество кадров и список отличий: отсутствующие, лишние и отличающиеся по содержимому файлы."""
+    names = sorted(name for name in os.listdir(str(expected)) if not name.startswith('.'))
+    missing = sorted(set(names) - set(os.listdir(str(actual))))
+    extra = sorted(name for name in set(os.listdir(str(actual))) - set(names) if not name.startswith('.'))
+    _, mismatch, _ = filecmp.cmpfiles(str(expected), str(actual), names, shallow=False)
+    return len(names), ['missing {}'.format(x) for x in missing] + ['extra {}'.format(x) for x in extra] + \
+        ['differs {}'.format(x) for x in mismatch]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Сравнение извлечения одним процессом и по отрезкам')
+    parser.add_argument('-s', '--size', type=str, default='640x360', action='store', help='Размер кадра')
+    parser.add_argument('-d', '--duration', type=int, default=60, action='store',
+                        help='Длительность видео (в секундах)')
+    parser.add_argument('--fps', type=int, default=25, action='store', help='Частота кадров')
+    parser.add_argument('--gop', type=int, default=250, action='store',
+                        help='Максимальное расстояние между ключевыми кадрами')
+    parser.add_argument('-n', '--segments', type=int, default=4, action='store', help='Количество отрезков')
+    parser.add_argument('-f', '--frame_interval', type=int, nargs='+', default=[1, 7], action='store',
+                        help='Шаги извлечения (в кадрах)')
+    parser.add_argument('-t', '--time_interval', type=lambda x: int(float(x) * 1000), nargs='+', default=[1300],
+                        action='store', help='Интервалы извлечения (в секундах)')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = Path(tmp) / 'clip.mp4'
+        make_clip(clip, args['size'], args['duration'], args['fps'], args['gop'])
+
+        single, single_time = extract(clip, Path(tmp) / 'single', 1, args['frame_interval'], args['time_interval'])
+        split, split_time = extract(clip, Path(tmp) / 'split', args['segments'],
+                                    args['frame_interval'], args['time_interval'])
+        bounds = split.segment_bounds()
+        print('Segments start at frames: {}'.format(', '.join(map(str, bounds[:-1])) if bounds else 'not split'))
+        print('1 process: {:.2f} s, {} processes: {:.2f} s'.format(single_time, args['segments'], split_time))
+
+        failed = False
+        for output in single.outputs:
+            count, differences = compare(single.output_path(output.name), split.output_path(output.name))
+            print('{}: {} frames, {} differences'.format(output.name, count, len(differences)))
+            for difference in differences[:10]:
+                print('    ' + difference)
+            failed = failed or bool(differences)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import sys
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+import os
+import argparse
+import statistics
+import subprocess as sp
+import tempfile
+import time
+from pathlib import Path
+
+# Время запуска wrapper.py: без манифеста (импортируются все модули, как раньше при каждом запуске)
+# и с актуальным манифестом (импортируется только модуль выбранной подкоманды).
+
+WRAPPER = Path(__file__).resolve().parent.parent / 'wrapper.py'
+
+
+def run(command, cache_dir, cold):
+    manifest = Path(cache_dir) / 'ffmpeg-wrapper' / 'plugins.json'
+    if cold and manifest.exists():
+        manifest.unlink()
+    env = dict(os.environ, XDG_CACHE_HOME=cache_dir)
+    start = time.perf_counter()
+    sp.run([sys.executable, str(WRAPPER), '-i', str(WRAPPER), '--debug', command], env=env, stdout=sp.DEVNULL,
+           check=True)
+    return time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Время запуска wrapper.py с манифестом модулей и без него')
+    parser.add_argument('-n', '--repeat', type=int, default=20, action='store', help='Количество запусков')
+    parser.add_argument('-c', '--command', type=str, default='split', action='store', help='Подкоманда')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = [run(args['command'], cache_dir, cold=True) for _ in range(args['repeat'])]
+        warm = [run(args['command'], cache_dir, cold=False) for _ in range(args['repeat'])]
+
+    print('Command: {}, runs: {}'.format(args['command'], args['repeat']))
+    print('Without manifest: {:.1f} ms (median)'.format(statistics.median(cold) * 1000))
+    print('With manifest:    {:.1f} ms (median)'.format(statistics.median(warm) * 1000))
+
+
+if __name__ == "__main__":
+    main()
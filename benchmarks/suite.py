@@ -0,0 +1,323 @@
+import sys
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+import argparse
+import contextlib
+import fnmatch
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess as sp
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rebase_frames
+from modules.extract import ACTION_MAP, SCAN_WORKERS, ExtractionTask, run_task, walk_on_tree
+from modules.metrics import count_files, get_ffmpeg_version, write_atomic
+from naming import create_frames, legacy_rename_pass
+from rebase import make_tree
+
+# Набор замеров для сравнения версий: синтетические видео генерируются локально источниками lavfi
+# (testsrc2, mandelbrot) в нескольких размерах, длительностях и расстояниях между ключевыми кадрами.
+# Замеряются все операции ACTION_MAP, прежний проход correct_filenames (удален: кадры получают имена
+# при записи, проход воспроизведен в naming.py), walk_on_tree на большом дереве и rebase_frames.main.
+# Результаты пишутся в JSON; --baseline сравнивает их с прошлым запуском и возвращает 1 при замедлении.
+#
+#   python benchmarks/suite.py -o baseline.json
+#   (изменения в extract.py)
+#   python benchmarks/suite.py -o current.json --baseline baseline.json
+#   python benchmarks/suite.py --compare baseline.json current.json
+
+RESULTS_VERSION = 1
+# Аргументы операций ACTION_MAP при замере
+OPERATION_ARGS = {
+    'frame_interval': 10,
+    'time_interval': 1000,
+    'scene': (0.3, 0.0, None),
+    'extract_all': None,
+}
+
+
+def make_clip(path, source, size, duration, gop, fps=25):
+    sp.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-f', 'lavfi',
+            '-i', '{}=size={}:rate={}'.format(source, size, fps), '-t', str(duration),
+            '-c:v', 'libx264', '-preset', 'veryfast', '-g', str(gop), '-pix_fmt', 'yuv420p', str(path)], check=True)
+
+
+def iter_clips(clips_dir, sources, sizes, durations, gops):
+    """Видео всех сочетаний параметров: (имя, путь). Уже сгенерированное видео переиспользуется, поэтому
+    при общей --clips_dir базовый и текущий запуски замеряются на одних и тех же файлах.
+    """
+    for source, size, duration, gop in itertools.product(sources, sizes, durations, gops):
+        name = '{}_{}_{}s_g{}'.format(source, size, duration, gop)
+        path = clips_dir / (name + '.mp4')
+        if not path.exists():
+            make_clip(path, source, size, duration, gop)
+        yield name, path
+
+
+def measure(run, repeats, prepare=None):
+    """Время run (в секундах) в repeats запусках. prepare вызывается перед каждым запуском вне замера.
+    Возвращает результат замера и значение, которое вернул последний запуск.
+    """
+    runs, value = [], None
+    for _ in range(repeats):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        value = run()
+        runs.append(time.perf_counter() - start)
+    return {'runs': [round(x, 6) for x in runs], 'median': round(statistics.median(runs), 6),
+            'min': round(min(runs), 6)}, value
+
+
+def bench_operation(clip, output_dir, operation, frame_format):
+    """Задача создается (и видео опрашивается) вне замера: замеряется только извлечение."""
+    tasks = []
+
+    def prepare():
+        shutil.rmtree(str(output_dir), ignore_errors=True)
+        task = ExtractionTask(clip, output_dir, frame_format)
+        ACTION_MAP[operation](task, OPERATION_ARGS.get(operation))
+        tasks[:] = [task]
+
+    def run():
+        task = tasks[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            status = run_task(task)
+        if status != 0:
+            raise RuntimeError('Extraction failed: {} {}'.format(operation, str(clip)))
+        return count_files([task.output_path(output.name) for output in task.outputs], task.ext)[0]
+    return prepare, run
+
+
+def bench_correct_filenames(directory, frames, frame_format):
+    uid = uuid.uuid4()
+
+    def prepare():
+        shutil.rmtree(str(directory), ignore_errors=True)
+        directory.mkdir(parents=True)
+        create_frames(directory, ('{}_{}.{}'.format(str(uid), i, frame_format) for i in range(1, frames + 1)))
+    return prepare, lambda: legacy_rename_pass(directory, uid, 1, frame_format)
+
+
+def make_media_tree(root, dirs, files_per_dir):
+    """Дерево из dirs директорий по files_per_dir пустых видео (и столько же других файлов) в два уровня."""
+    for i in range(dirs):
+        directory = root / 'group_{}'.format(i // 100) / 'dir_{}'.format(i)
+        directory.mkdir(parents=True, exist_ok=True)
+        for n in range(files_per_dir):
+            (directory / 'clip_{}.mp4'.format(n)).touch()
+            (directory / 'frame_{}.png'.format(n)).touch()
+
+
+def bench_rebase_frames(root, files, files_per_dir):
+    def prepare():
+        shutil.rmtree(str(root), ignore_errors=True)
+        make_tree(root, files, files_per_dir)
+
+    def run():
+        argv = sys.argv
+        sys.argv = ['rebase_frames.py', str(root), '--full']
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                errors = rebase_frames.main()
+        finally:
+            sys.argv = argv
+        if errors:
+            raise RuntimeError('rebase_frames failed {} moves: {}'.format(errors, str(root)))
+    return prepare, run
+
+
+def run_suite(args, work_dir, clips_dir):
+    """Выполняет замеры, имена которых подходят под --only. Возвращает {имя замера: результат}."""
+    results = {}
+
+    def selected(name):
+        return not args['only'] or any(fnmatch.fnmatchcase(name, pattern) for pattern in args['only'])
+
+    def record(name, result, **extra):
+        result.update(extra)
+        results[name] = result
+        print('{:<60} median {:>9.4f} s, min {:>9.4f} s'.format(name, result['median'], result['min']), flush=True)
+
+    operations = [operation for operation in ACTION_MAP if operation in OPERATION_ARGS]
+    for operation in sorted(set(ACTION_MAP) - set(operations)):
+        print('{} - no benchmark arguments in OPERATION_ARGS. Skip.'.format(operation))
+    if any(selected('extract/{}/*'.format(operation)) for operation in operations):
+        for clip_name, clip in iter_clips(clips_dir, args['sources'], args['sizes'], args['durations'], args['gops']):
+            for operation in operations:
+                name = 'extract/{}/{}'.format(operation, clip_name)
+                if selected(name):
+                    prepare, run = bench_operation(clip, work_dir / 'extract', operation, args['format'])
+                    result, frames = measure(run, args['repeats'], prepare)
+                    record(name, result, frames=frames)
+        shutil.rmtree(str(work_dir / 'extract'), ignore_errors=True)
+
+    name = 'correct_filenames/legacy/{}'.format(args['frames'])
+    if selected(name):
+        prepare, run = bench_correct_filenames(work_dir / 'frames', args['frames'], args['format'])
+        record(name, measure(run, args['repeats'], prepare)[0], frames=args['frames'])
+        shutil.rmtree(str(work_dir / 'frames'), ignore_errors=True)
+
+    tree_name = '{}x{}'.format(args['tree_dirs'], args['tree_files'])
+    workers = sorted({1, args['scan_jobs'] or SCAN_WORKERS})
+    if any(selected('walk_on_tree/{}/workers_{}'.format(tree_name, count)) for count in workers):
+        tree = work_dir / 'tree'
+        make_media_tree(tree, args['tree_dirs'], args['tree_files'])
+        for count in workers:
+            name = 'walk_on_tree/{}/workers_{}'.format(tree_name, count)
+            if selected(name):
+                result, media = measure(lambda: sum(1 for _ in walk_on_tree([tree], None, True, workers=count)),
+                                        args['repeats'])
+                record(name, result, media=media)
+        shutil.rmtree(str(tree), ignore_errors=True)
+
+    name = 'rebase_frames/{}'.format(args['rebase_files'])
+    if selected(name):
+        prepare, run = bench_rebase_frames(work_dir / 'rebase', args['rebase_files'], args['rebase_files_per_dir'])
+        record(name, measure(run, args['repeats'], prepare)[0], files=args['rebase_files'])
+        shutil.rmtree(str(work_dir / 'rebase'), ignore_errors=True)
+    return results
+
+
+def get_commit():
+    try:
+        return sp.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(Path(__file__).resolve().parent),
+                               stderr=sp.DEVNULL).decode('utf8').strip()
+    except (OSError, sp.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold, min_delta):
+    """Сравнивает медианы замеров, которые есть в обоих результатах. Замедление - медиана выросла больше чем
+    на threshold (доля) и больше чем на min_delta секунд: короткие замеры иначе шумят. Возвращает число замедлений.
+    """
+    base, cur = baseline['results'], current['results']
+    for key in ('ffmpeg_version', 'cpu_count'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print('Warning: {} differs: {} -> {}'.format(key, baseline['meta'].get(key), current['meta'].get(key)))
+
+    regressions = 0
+    print('{:<60} {:>10} {:>10} {:>8}'.format('benchmark', 'baseline', 'current', 'change'))
+    for name in sorted(set(base) & set(cur)):
+        before, after = base[name]['median'], cur[name]['median']
+        change = (after - before) / before if before > 0 else 0.0
+        status = ''
+        if change > threshold and after - before > min_delta:
+            status = 'REGRESSION'
+            regressions += 1
+        elif change < -threshold and before - after > min_delta:
+            status = 'faster'
+        print('{:<60} {:>9.4f}s {:>9.4f}s {:>+7.1%} {}'.format(name, before, after, change, status))
+    for name in sorted(set(base) - set(cur)):
+        print('{:<60} missing in current results'.format(name))
+    for name in sorted(set(cur) - set(base)):
+        print('{:<60} new, not in baseline'.format(name))
+    print('{} regressions (threshold {:.0%}, min delta {} s)'.format(regressions, threshold, min_delta))
+    return regressions
+
+
+def load_results(path):
+    with open(str(path)) as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError('{}: unsupported results version {}'.format(str(path), results.get('version')))
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Набор замеров производительности с JSON-результатами и сравнением '
+                                                 'с базовым запуском')
+    parser.add_argument('-o', '--output', type=str, default='benchmark_results.json', action='store',
+                        help='Файл результатов (JSON)')
+    parser.add_argument('--baseline', type=str, action='store',
+                        help='Результаты базового запуска: после замеров сравнить с ними')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BASELINE', 'CURRENT'), action='store',
+                        help='Только сравнить два файла результатов, без замеров')
+    parser.add_argument('--threshold', type=float, default=0.1, action='store',
+                        help='Допустимое замедление медианы (доля)')
+    parser.add_argument('--min_delta', type=float, default=0.01, action='store',
+                        help='Замедление меньше этого (в секундах) не считается регрессией')
+    parser.add_argument('-r', '--repeats', type=int, default=3, action='store', help='Количество запусков замера')
+    parser.add_argument('--only', type=str, nargs='+', default=[], metavar='PATTERN', action='store',
+                        help='Только замеры с именами, подходящими под шаблон fnmatch (например extract/scene/*)')
+    parser.add_argument('--sources', type=str, nargs='+', default=['testsrc2', 'mandelbrot'], action='store',
+                        help='Источники lavfi')
+    parser.add_argument('--sizes', type=str, nargs='+', default=['320x240', '1280x720'], action='store',
+                        help='Размеры кадра')
+    parser.add_argument('--durations', type=int, nargs='+', default=[10], action='store',
+                        help='Длительности видео (в секундах)')
+    parser.add_argument('--gops', type=int, nargs='+', default=[25, 250], action='store',
+                        help='Максимальные расстояния между ключевыми кадрами')
+    parser.add_argument('--format', type=str, default='png', action='store', help='Формат кадров')
+    parser.add_argument('--frames', type=int, default=100000, action='store',
+                        help='Количество кадров для прохода correct_filenames')
+    parser.add_argument('--tree_dirs', type=int, default=2000, action='store',
+                        help='Количество директорий дерева для walk_on_tree')
+    parser.add_argument('--tree_files', type=int, default=20, action='store',
+                        help='Количество видео в директории дерева для walk_on_tree')
+    parser.add_argument('--scan_jobs', type=int, default=0, action='store',
+                        help='Потоки обхода для walk_on_tree (0 - {})'.format(SCAN_WORKERS))
+    parser.add_argument('--rebase_files', type=int, default=100000, action='store',
+                        help='Количество кадров для rebase_frames.main')
+    parser.add_argument('--rebase_files_per_dir', type=int, default=1000, action='store',
+                        help='Количество кадров в директории для rebase_frames.main')
+    parser.add_argument('--clips_dir', type=str, action='store',
+                        help='Директория сгенерированных видео (по умолчанию временная). Видео переиспользуются')
+    parser.add_argument('--dir', type=str, action='store', help='Рабочая директория (по умолчанию временная)')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+
+    if args['compare']:
+        return 1 if compare(load_results(args['compare'][0]), load_results(args['compare'][1]),
+                            args['threshold'], args['min_delta']) else 0
+    if args['repeats'] < 1:
+        print('Repeats must be >= 1')
+        return 1
+    baseline = load_results(args['baseline']) if args['baseline'] else None
+
+    with tempfile.TemporaryDirectory(dir=args['dir']) as tmp:
+        clips_dir = Path(args['clips_dir']) if args['clips_dir'] else Path(tmp) / 'clips'
+        clips_dir.mkdir(parents=True, exist_ok=True)
+        started = time.time()
+        results = run_suite(args, Path(tmp), clips_dir)
+
+    report = {
+        'version': RESULTS_VERSION,
+        'meta': {
+            'started': started,
+            'commit': get_commit(),
+            'host': platform.node(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'ffmpeg_version': get_ffmpeg_version(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in args.items() if key not in ('output', 'baseline', 'compare')},
+        },
+        'results': results,
+    }
+    write_atomic(args['output'], json.dumps(report, indent=4))
+    print('Results: {}'.format(args['output']))
+
+    if baseline is not None:
+        return 1 if compare(baseline, report, args['threshold'], args['min_delta']) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
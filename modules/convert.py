@@ -1,19 +1,184 @@
+import os
 import sys
+import time
+import subprocess as sp
+from pathlib import Path
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor
 
 if sys.version_info[0] < 3:
     sys.stderr.write("You need Python 3 or later to run this script!\n")
     sys.exit(1)
 
+from modules.probe import FFPROBE, probe_many
+from modules.extract import walk_on_tree
+
+# Целевой формат: контейнер, видеокодек (имя в ffprobe и кодировщик ffmpeg с параметрами) и аудиокодек.
+# Поток, который уже закодирован целевым кодеком, копируется без перекодирования
+Preset = namedtuple('Preset', ('container', 'video_codec', 'video_options', 'audio_codec', 'audio_options'))
+PRESETS = {
+    'h264': Preset('.mp4', 'h264', ('-c:v', 'libx264', '-preset', 'medium', '-crf', '20', '-pix_fmt', 'yuv420p'),
+                   'aac', ('-c:a', 'aac', '-b:a', '128k')),
+    'h264_fast': Preset('.mp4', 'h264', ('-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'),
+                        'aac', ('-c:a', 'aac', '-b:a', '128k')),
+    'hevc': Preset('.mp4', 'hevc', ('-c:v', 'libx265', '-preset', 'medium', '-crf', '26', '-pix_fmt', 'yuv420p',
+                                    '-tag:v', 'hvc1'),
+                   'aac', ('-c:a', 'aac', '-b:a', '128k')),
+}
+# Потоков кодировщика на одну задачу при автоматическом выборе количества задач: libx264/libx265 плохо
+# масштабируются на много потоков, поэтому выгоднее несколько одновременных задач по JOB_THREADS потоков
+JOB_THREADS = 4
+
+ConvertReport = namedtuple('ConvertReport', ('media', 'output', 'action', 'elapsed', 'returncode'))
+
 
 def add_subparser(module_name, subparsers):
     parser = subparsers.add_parser(module_name, help='Задачи конвертации видео в другие форматы')
     parser.set_defaults(command=module_name)
+    parser.add_argument('-p', '--preset', type=str, default='h264', choices=sorted(PRESETS), action='store',
+                        help='Целевой кодек и контейнер')
+    parser.add_argument('--cpu_budget', type=int, default=0, action='store',
+                        help='Количество ядер для всех задач вместе (0 - все ядра)')
+    parser.add_argument('-j', '--jobs', type=int, default=0, action='store',
+                        help='Количество одновременных задач (0 - по {} потока на задачу в пределах --cpu_budget)'
+                        .format(JOB_THREADS))
+    parser.add_argument('--force', action='store_true', help='Конвертировать, даже если результат не устарел')
+    parser.add_argument('--include', type=str, nargs='+', default=[], metavar='PATTERN', action='store',
+                        help='Обрабатывать во входных директориях только файлы, подходящие под шаблон (fnmatch)')
+    parser.add_argument('--exclude', type=str, nargs='+', default=[], metavar='PATTERN', action='store',
+                        help='Пропускать файлы и директории, подходящие под шаблон')
+
+
+def get_audio_codec(media):
+    """Кодек первого аудиопотока или None, если аудио нет."""
+    try:
+        ffprobe_output = sp.check_output(
+            [FFPROBE, '-v', '0', '-of', 'csv=p=0', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name',
+             str(media)]
+        ).decode('utf8')
+    except (sp.CalledProcessError, UnicodeDecodeError) as err:
+        print(err)
+        return None
+    return ffprobe_output.strip() or None
+
+
+def get_output(media, output_dir, preset):
+    return output_dir / (media.stem + PRESETS[preset].container)
+
+
+def is_up_to_date(media, output):
+    """Результат не устарел: после конвертации ему присваивается mtime исходного файла (как make и rsync -t),
+    а запись идет во временный файл, поэтому непустой файл с тем же mtime - завершенная конвертация этого видео.
+    """
+    try:
+        source, target = media.stat(), output.stat()
+    except OSError:
+        return False
+    return target.st_size > 0 and target.st_mtime_ns == source.st_mtime_ns
+
+
+def convert_command(media, output, preset, info, threads=0):
+    """Команда ffmpeg и действие: copy - все потоки уже в целевых кодеках и копируются (-c copy),
+    transcode - перекодируются только потоки с другим кодеком.
+    """
+    preset = PRESETS[preset]
+    copy_video = info is not None and info.codec_name == preset.video_codec
+    audio_codec = get_audio_codec(media) if copy_video else None
+    copy_audio = copy_video and audio_codec in (None, preset.audio_codec)
+
+    video = ('-c:v', 'copy') if copy_video else preset.video_options + ('-threads', str(threads))
+    audio = ('-c:a', 'copy') if copy_audio else preset.audio_options
+    command = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-i', str(media),
+        '-map', '0:v:0', '-map', '0:a?', *video, *audio, '-movflags', '+faststart', str(output),
+    ]
+    return command, 'copy' if copy_video and copy_audio else 'transcode'
+
+
+def convert_media(media, output, preset, info, threads=0):
+    """Конвертирует media в output через временный файл рядом с ним. Возвращает ConvertReport."""
+    output.parent.mkdir(parents=True, exist_ok=True)
+    partial = output.with_name('.{}.part{}'.format(output.stem, output.suffix))
+    command, action = convert_command(media, partial, preset, info, threads)
+
+    start = time.perf_counter()
+    result = sp.run(command)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        if partial.exists():
+            partial.unlink()
+        return ConvertReport(media, output, action, elapsed, result.returncode)
+
+    stat = media.stat()
+    os.utime(str(partial), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    partial.replace(output)
+    return ConvertReport(media, output, action, elapsed, 0)
+
+
+def get_pool_size(jobs, cpu_budget, tasks_count):
+    """Количество одновременных задач и потоков кодировщика на задачу в пределах cpu_budget ядер."""
+    if cpu_budget <= 0:
+        cpu_budget = os.cpu_count() or 1
+    if jobs <= 0:
+        jobs = cpu_budget // JOB_THREADS
+    jobs = max(1, min(jobs, cpu_budget, tasks_count))
+    return jobs, max(1, cpu_budget // jobs)
 
 
 def main(parsed_args=None):
     if parsed_args is None:
         return
 
+    output_directory = parsed_args.get('output_directory')
+    preset = parsed_args.get('preset', 'h264')
+    # Выходы собираются до конвертации: x.avi и x.mp4 в одной директории дают один выход x.mp4, который
+    # перезаписал бы исходный x.mp4, а два видео с одним выходом писали бы в один временный файл
+    candidates = [(media, get_output(media, output_dir, preset))
+                  for media, output_dir in walk_on_tree(map(Path, parsed_args['input']),
+                                                        Path(output_directory) if output_directory else None,
+                                                        parsed_args['recursive'],
+                                                        parsed_args.get('include'),
+                                                        parsed_args.get('exclude'),
+                                                        )]
+    inputs = set(media.absolute() for media, _ in candidates)
+    claims = Counter(output.absolute() for _, output in candidates)
+    sources = []
+    for media, output in candidates:
+        if output.absolute() in inputs:
+            print('{} - output {} is an input file, set another output directory. Skip.'.format(str(media),
+                                                                                                str(output)))
+        elif claims[output.absolute()] > 1:
+            print('{} - output {} is the output of {} input files. Skip.'.format(str(media), str(output),
+                                                                              claims[output.absolute()]))
+        elif not parsed_args.get('force') and is_up_to_date(media, output):
+            print('{} - up to date. Skip.'.format(str(output)))
+        else:
+            sources.append((media, output))
+    if not sources:
+        return 0
+
+    jobs, threads = get_pool_size(parsed_args.get('jobs', 0), parsed_args.get('cpu_budget', 0), len(sources))
+    infos = probe_many([media for media, _ in sources])
+
+    def run(source):
+        media, output = source
+        report = convert_media(media, output, preset, infos.get(media), threads)
+        if report.returncode != 0:
+            print('ffmpeg exited with code {}: {}'.format(report.returncode, str(media)))
+        else:
+            print('{} -> {}: {} in {:.2f} s'.format(str(media), str(output), report.action, report.elapsed))
+        return report
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        reports = list(executor.map(run, sources))
+
+    failed = [report for report in reports if report.returncode != 0]
+    print('Converted {} of {} files ({} copied) in {:.2f} s: {} jobs x {} threads'.format(
+        len(reports) - len(failed), len(reports), sum(1 for report in reports if report.action == 'copy'),
+        time.perf_counter() - start, jobs, threads))
+    return 1 if failed else 0
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import multiprocessing
+from pathlib import Path
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HASH_METHODS = ('dhash', 'phash')
+DEDUP_MODES = ('remove', 'move')
+# Сторона хэша в битах: хэш занимает HASH_SIZE*HASH_SIZE = 64 бита
+HASH_SIZE = 8
+# Сторона уменьшенного изображения для pHash (из DCT берется левый верхний угол HASH_SIZE x HASH_SIZE)
+PHASH_SIZE = 32
+# Количество файлов, которые один процесс хэширует за раз
+HASH_BATCH_SIZE = 512
+# Директория внутри директории кадров, куда переносятся дубликаты в режиме move
+DUPLICATES_DIRNAME = 'duplicates'
+
+DedupReport = namedtuple('DedupReport', ('kept', 'removed', 'failed', 'hash_time', 'search_time', 'remove_time'))
+
+
+def load_gray(paths, size):
+    """Загружает изображения в оттенках серого, уменьшенные до size (ширина, высота), одним массивом.
+    Возвращает массив (n, высота, ширина) и маску успешно прочитанных файлов.
+    """
+    images = np.zeros((len(paths), size[1], size[0]), dtype=np.float32)
+    loaded = np.zeros(len(paths), dtype=bool)
+    for i, path in enumerate(paths):
+        try:
+            with Image.open(path) as image:
+                image.draft('L', size)
+                images[i] = np.asarray(image.convert('L').resize(size, Image.BOX), dtype=np.float32)
+            loaded[i] = True
+        except (OSError, ValueError) as err:
+            print(err)
+    return images, loaded
+
+
+def pack_bits(bits):
+    """Массив (n, 64) из bool в список 64-битных целых."""
+    return [int(x) for x in np.packbits(bits, axis=1).view('>u8').ravel()]
+
+
+def dct_matrix(n):
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+def hash_batch(paths, method='dhash'):
+    """Хэши пачки файлов: dHash - знак разности соседних пикселей по строке, pHash - сравнение низкочастотных
+    коэффициентов DCT с их медианой. Все изображения пачки обрабатываются одним вычислением над массивом.
+    Для непрочитанных файлов возвращает None.
+    """
+    if method == 'dhash':
+        images, loaded = load_gray(paths, (HASH_SIZE + 1, HASH_SIZE))
+        bits = (images[:, :, 1:] > images[:, :, :-1]).reshape(len(paths), -1)
+    elif method == 'phash':
+        images, loaded = load_gray(paths, (PHASH_SIZE, PHASH_SIZE))
+        dct = dct_matrix(PHASH_SIZE)
+        coefficients = (dct @ images @ dct.T)[:, :HASH_SIZE, :HASH_SIZE].reshape(len(paths), -1)
+        bits = coefficients > np.median(coefficients[:, 1:], axis=1, keepdims=True)
+    else:
+        raise ValueError('Unknown hash method: {}'.format(method))
+    return [value if ok else None for value, ok in zip(pack_bits(bits), loaded)]
+
+
+def get_mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def hash_files(paths, method='dhash', workers=0, batch_size=HASH_BATCH_SIZE):
+    """Хэши файлов в порядке paths. Пачки по batch_size файлов распределяются по пулу из workers процессов."""
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    if not batches:
+        return []
+    workers = max(1, min(workers or os.cpu_count() or 1, len(batches)))
+    if workers == 1:
+        results = [hash_batch(batch, method) for batch in batches]
+    else:
+        # Пул запускается из потока пула задач, пока другие потоки держат блокировки (вывод, прогресс, sqlite):
+        # дочерний процесс, созданный fork, унаследовал бы их захваченными и мог бы зависнуть
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_mp_context()) as executor:
+            results = list(executor.map(hash_batch, batches, [method] * len(batches)))
+    return [value for batch in results for value in batch]
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class MultiIndexHash:
+    """Индекс хэшей для поиска в радиусе radius по расстоянию Хэмминга (multi-index hashing).
+    Хэш делится на radius + 1 частей: у хэшей на расстоянии не больше radius хотя бы одна часть совпадает
+    полностью, поэтому сравниваются только хэши из корзин с совпадающими частями, а не все добавленные.
+    """
+
+    def __init__(self, radius, bits=HASH_SIZE * HASH_SIZE):
+        if not 0 <= radius < bits:
+            raise ValueError('Radius must be in range 0-{}'.format(bits - 1))
+        self.__radius = radius
+        count = radius + 1
+        bounds = [bits * i // count for i in range(count + 1)]
+        self.__chunks = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+        self.__tables = [{} for _ in self.__chunks]
+        self.__size = 0
+
+    def keys(self, value):
+        return ((value >> shift) & mask for shift, mask in self.__chunks)
+
+    def add(self, value):
+        self.__size += 1
+        for table, key in zip(self.__tables, self.keys(value)):
+            table.setdefault(key, []).append(value)
+
+    def find(self, value):
+        """Любой добавленный хэш на расстоянии не больше radius или None."""
+        for table, key in zip(self.__tables, self.keys(value)):
+            for candidate in table.get(key, ()):
+                if hamming(value, candidate) <= self.__radius:
+                    return candidate
+        return None
+
+    def __len__(self):
+        return self.__size
+
+
+def prune_duplicates(directory, ext, distance=4, mode='remove', method='dhash', workers=0):
+    """Удаляет (или переносит в DUPLICATES_DIRNAME) кадры, хэш которых отличается от хэша одного из уже
+    оставленных кадров не больше чем на distance бит. Кадры просматриваются в порядке имен (номеров кадров),
+    поэтому из серии похожих остается первый. Возвращает DedupReport.
+    """
+    if np is None or Image is None:
+        raise ImportError('Frame deduplication requires numpy and Pillow')
+    if mode not in DEDUP_MODES:
+        raise ValueError('Unknown dedup mode: {}'.format(mode))
+    directory = Path(directory)
+
+    with os.scandir(str(directory)) as entries:
+        paths = sorted(entry.path for entry in entries if entry.is_file() and entry.name.endswith('.' + ext))
+
+    start = time.perf_counter()
+    hashes = hash_files(paths, method, workers)
+    hash_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = MultiIndexHash(distance)
+    duplicates = []
+    for path, value in zip(paths, hashes):
+        if value is None:
+            continue
+        if index.find(value) is None:
+            index.add(value)
+        else:
+            duplicates.append(path)
+    search_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if mode == 'move' and duplicates:
+        (directory / DUPLICATES_DIRNAME).mkdir(exist_ok=True)
+    for path in duplicates:
+        if mode == 'move':
+            os.replace(path, str(directory / DUPLICATES_DIRNAME / os.path.basename(path)))
+        else:
+            os.remove(path)
+    remove_time = time.perf_counter() - start
+
+    report = DedupReport(len(index), len(duplicates), hashes.count(None), hash_time, search_time, remove_time)
+    print('Dedup {}: kept {}, {} {}, unreadable {} (hash {:.2f} s, search {:.2f} s, {} {:.2f} s)'.format(
+        str(directory), report.kept, 'moved' if mode == 'move' else 'removed', report.removed, report.failed,
+        report.hash_time, report.search_time, mode, report.remove_time))
+    return report
+
+
+if __name__ == "__main__":
+    pass
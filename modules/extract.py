@@ -1,17 +1,71 @@
+import os
 import sys
+import json
+import argparse
+import math
+import fnmatch
 import itertools
-import re
+import time
 import uuid
 import subprocess as sp
 from pathlib import Path
+from fractions import Fraction
 from functools import partial
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 if sys.version_info[0] < 3:
     sys.stderr.write("You need Python 3 or later to run this script!\n")
     sys.exit(1)
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from modules.fileops import IO_WORKERS
+from modules.probe import probe, probe_many, get_keyframe_interval, get_keyframes
+from modules import dedup
+from modules.progress import PROGRESS_MODES, ProgressReporter, run_ffmpeg
+from modules.metrics import MetricsReport
+from modules.shards import OUTPUT_BACKENDS, SHARD_SIZE, packing, read_index
+from modules.scheduler import AdaptiveScheduler, DISK_RESERVE, MAX_JOBS_FACTOR
+
 MEDIA_FORMAT = (".avi", ".mp4")
-IMAGE_FORMAT = ("png", "jpg", "bmp")
+IMAGE_FORMAT = ("png", "jpg", "bmp", "ppm", "webp")
+# Профили кодирования кадров: fast - минимальное сжатие, balanced - сжатие не медленнее PNG по умолчанию
+# при меньшем размере, small - максимальное сжатие без потерь. Замеры: benchmarks/encoding.py
+ENCODING_PROFILES = ('fast', 'balanced', 'small')
+ENCODER_OPTIONS = {
+    'png': {
+        'fast': ('-compression_level', '1'),
+        'balanced': ('-compression_level', '3', '-pred', 'paeth'),
+        'small': ('-compression_level', '9', '-pred', 'mixed'),
+    },
+    'webp': {
+        'fast': ('-c:v', 'libwebp', '-lossless', '1', '-compression_level', '0'),
+        'balanced': ('-c:v', 'libwebp', '-lossless', '1', '-compression_level', '2'),
+        'small': ('-c:v', 'libwebp', '-lossless', '1', '-compression_level', '6'),
+    },
+}
+# Качество JPEG по умолчанию (1-100)
+JPEG_QUALITY = 95
+# Ширина номера кадра в имени файла: при дополнении нулями лексикографический порядок совпадает с порядком кадров
+FRAME_NUMBER_WIDTH = 8
+# Режимы выборки по времени: auto - перемотка (-ss) или полное декодирование в зависимости от интервала
+SEEK_MODES = ('auto', 'always', 'never')
+# Перемотка выгоднее полного декодирования, когда интервал в SEEK_GOP_FACTOR раз больше расстояния между
+# ключевыми кадрами, но не меньше SEEK_MIN_INTERVAL секунд (иначе дороже запуск ffmpeg на каждый кадр)
+SEEK_GOP_FACTOR = 4
+SEEK_MIN_INTERVAL = 2.0
+# Наибольший знаменатель частоты кадров: по нему float fps восстанавливается в точную дробь (30000/1001 и т.п.)
+FPS_MAX_DENOMINATOR = 100000
+# Состояние извлечения в выходной директории задачи: параметры ветвей, завершенные ветви и номер последнего кадра
+CHECKPOINT_FILE = '.extract.json'
+# Потоки обхода входных директорий
+SCAN_WORKERS = IO_WORKERS
+# Количество найденных медиафайлов, которые опрашиваются одним вызовом probe_many во время обхода
+PROBE_BATCH_SIZE = 64
 
 
 def add_subparser(module_name, subparsers):
@@ -19,78 +73,245 @@ def add_subparser(module_name, subparsers):
     parser.set_defaults(command=module_name)
     parser.add_argument("--format", type=str, default="png", choices=IMAGE_FORMAT,
                         help="Формат извлекаемых кадров.", action="store")
-    group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument("-f", "--frame_interval", type=int, action="store",
+    parser.add_argument("--output_backend", type=str, default="files", choices=OUTPUT_BACKENDS, action="store",
+                        help="Куда писать кадры: files - файл на кадр, tar - шарды tar (как в WebDataset), "
+                             "pack - один файл на директорию; у tar и pack есть индекс index.tsv для чтения "
+                             "по номеру кадра (modules/shards.py, FrameArchive).")
+    parser.add_argument("--shard_size", type=int, default=SHARD_SIZE // 1024 ** 2, metavar='MB', action="store",
+                        help="Размер шарда tar (в мегабайтах).")
+    parser.add_argument("--profile", type=str, default="balanced", choices=ENCODING_PROFILES, action="store",
+                        help="Профиль кодирования кадров: fast - быстрее, small - меньше размер (png, webp).")
+    parser.add_argument("--quality", type=quality_type, action="store",
+                        help="Качество сжатия с потерями от 1 до 100 (jpg, webp; для jpg по умолчанию {})."
+                        .format(JPEG_QUALITY))
+    parser.add_argument("-j", "--jobs", type=int, default=0, action="store",
+                        help="Количество одновременно выполняемых задач (0 - по числу ядер).")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Подбирать количество одновременных задач во время работы по скорости извлечения, "
+                             "свободной памяти и ожиданию ввода-вывода (-j - верхняя граница, 0 - {} на ядро)."
+                        .format(MAX_JOBS_FACTOR))
+    parser.add_argument("--min_free_disk", type=int, default=DISK_RESERVE // 1024 ** 2, metavar='MB', action="store",
+                        help="С --adaptive не запускать новые задачи, пока на томе выходной директории "
+                             "свободно меньше MB мегабайт.")
+    parser.add_argument("--segments", type=int, default=1, action="store",
+                        help="Делить каждое видео на N отрезков по ключевым кадрам и извлекать их параллельно "
+                             "(для длинных видео).")
+    parser.add_argument("--progress", type=str, default="text", choices=PROGRESS_MODES, action="store",
+                        help="Вывод прогресса: кадры, кадров в секунду, скорость и оставшееся время по задачам "
+                             "и в целом (json - одна строка JSON на событие).")
+    parser.add_argument("--metrics", type=os.path.abspath, metavar='FILE', action="store",
+                        help="Записать метрики задач (время опроса, ffmpeg и постобработки, процессорное время, "
+                             "кадры и байты) в JSON.")
+    parser.add_argument("--metrics_textfile", type=os.path.abspath, metavar='FILE', action="store",
+                        help="Записать итоговые метрики запуска в текстовый файл Prometheus (node-exporter, *.prom).")
+    parser.add_argument("--seek", type=str, default="auto", choices=SEEK_MODES, action="store",
+                        help="Выборка по времени перемоткой к каждой метке вместо декодирования всего видео.")
+    parser.add_argument("--dedup", type=int, metavar='DISTANCE', action="store",
+                        help="Убрать похожие кадры: расстояние Хэмминга между перцептивными хэшами (из 64 бит), "
+                             "при котором кадр считается дубликатом уже оставленного.")
+    parser.add_argument("--dedup_mode", type=str, default="remove", choices=dedup.DEDUP_MODES, action="store",
+                        help="Удалить дубликаты или перенести их в поддиректорию {}.".format(dedup.DUPLICATES_DIRNAME))
+    parser.add_argument("--dedup_hash", type=str, default="dhash", choices=dedup.HASH_METHODS, action="store",
+                        help="Перцептивный хэш для поиска дубликатов.")
+    parser.add_argument("--include", type=str, nargs='+', default=[], metavar='PATTERN', action="store",
+                        help="Обрабатывать во входных директориях только файлы, подходящие под шаблон "
+                             "(fnmatch, без учета регистра; шаблон с '/' сравнивается с относительным путем).")
+    parser.add_argument("--exclude", type=str, nargs='+', default=[], metavar='PATTERN', action="store",
+                        help="Пропускать файлы и директории, подходящие под шаблон "
+                             "(исключенные директории не читаются).")
+    parser.add_argument("--scan_jobs", type=int, default=1, action="store",
+                        help="Количество потоков обхода входных директорий (больше 1 - для сетевых файловых систем, "
+                             "0 - {}).".format(SCAN_WORKERS))
+    group = parser.add_argument_group('Операции (можно комбинировать, видео декодируется один раз)')
+    group.add_argument("-f", "--frame_interval", type=int, nargs='+', action="store",
                        help="Значение шага извлечения (в кадрах)")
-    group.add_argument('-t', '--time_interval', type=lambda x: int(float(x) * 1000), action='store',
+    group.add_argument('-t', '--time_interval', type=lambda x: int(float(x) * 1000), nargs='+', action='store',
                        help='Значение интервала времени извлечения кадров (в секундах) ')
+    group.add_argument('-s', '--scene', type=scene_type, nargs='+', action='store',
+                       metavar='THRESHOLD[:MIN_GAP[:MAX_GAP]]',
+                       help='Извлекать кадры при смене сцены: порог оценки сцены от 0 до 1, минимальный и максимальный '
+                            'интервал между кадрами (в секундах), например 0.3:1:60')
     group.add_argument('-a', '--extract_all', help='Извлечь все кадры', action='store_true')
 
 
-def walk_on_tree(path_list, root_output_dir, recursive=False):
+def quality_type(value):
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise argparse.ArgumentTypeError('Quality must be in range 1-100')
+    return quality
+
+
+def scene_type(value):
+    """Разбирает THRESHOLD[:MIN_GAP[:MAX_GAP]] в кортеж (порог, минимальный интервал, максимальный интервал)."""
+    parts = value.split(':')
+    if len(parts) > 3:
+        raise argparse.ArgumentTypeError('Expected THRESHOLD[:MIN_GAP[:MAX_GAP]]: {}'.format(value))
+    try:
+        threshold = float(parts[0])
+        min_gap = float(parts[1]) if len(parts) > 1 and parts[1] else 0.0
+        max_gap = float(parts[2]) if len(parts) > 2 and parts[2] else None
+    except ValueError:
+        raise argparse.ArgumentTypeError('Expected THRESHOLD[:MIN_GAP[:MAX_GAP]]: {}'.format(value))
+    return threshold, min_gap, max_gap
+
+
+def encoder_options(frame_format, profile='balanced', quality=None):
+    """Параметры кодировщика изображений для формата и профиля. quality (1-100) задает качество JPEG
+    и переключает WebP в режим сжатия с потерями. bmp и ppm не сжимаются и параметров не имеют.
+    """
+    if frame_format not in IMAGE_FORMAT:
+        raise ValueError('Unknown image format: {}'.format(frame_format))
+    if profile not in ENCODING_PROFILES:
+        raise ValueError('Unknown encoding profile: {}'.format(profile))
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError('Quality must be in range 1-100')
+
+    if frame_format == 'jpg':
+        # Шкала mjpeg -q:v: 2 - лучшее качество, 31 - худшее
+        quality = JPEG_QUALITY if quality is None else quality
+        return '-q:v', str(round(31 - (quality - 1) * 29 / 99))
+    options = ENCODER_OPTIONS.get(frame_format, {}).get(profile, ())
+    if frame_format == 'webp' and quality is not None:
+        options = options[:2] + ('-lossless', '0', '-quality', str(quality)) + options[4:]
+    return options
+
+
+def match_rules(name, relpath, patterns):
+    """Совпадает ли файл (директория) хотя бы с одним шаблоном fnmatch. Шаблон без '/' сравнивается с именем,
+    шаблон с '/' - с путем относительно входной директории. Шаблоны и пути передаются в нижнем регистре.
+    """
+    return any(fnmatch.fnmatchcase(relpath if '/' in pattern else name, pattern) for pattern in patterns)
+
+
+def scan_dir(directory, relpath, recursive=False, include=(), exclude=()):
+    """Одно чтение директории os.scandir. Возвращает отсортированные имена медиафайлов, подходящих под include
+    и не подходящих под exclude, и поддиректории для обхода (директория, путь относительно входной директории).
+    Исключенная директория не читается.
+    """
+    names, sub_dirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name.lower()
+                # relpath хранит исходный регистр (он нужен для выходных путей), шаблоны сравниваются в нижнем
+                rel = (relpath + '/' + name).lower() if relpath else name
+                if exclude and match_rules(name, rel, exclude):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        sub_dirs.append((entry.path, relpath + '/' + entry.name if relpath else entry.name))
+                elif name.endswith(MEDIA_FORMAT) and (not include or match_rules(name, rel, include)) \
+                        and entry.is_file():
+                    names.append(entry.name)
+    except OSError as err:
+        print(err)
+    return sorted(names), sorted(sub_dirs)
+
+
+def scan_tree(root, recursive=False, include=(), exclude=(), workers=1):
+    """Обходит дерево одним проходом: каждая директория читается один раз. По мере чтения возвращает
+    (директория, путь относительно root, имена медиафайлов). При workers > 1 поддиректории читаются параллельно
+    в пуле потоков и возвращаются в порядке завершения чтения.
+    """
+    scan = partial(scan_dir, recursive=recursive, include=include, exclude=exclude)
+    if workers <= 1:
+        stack = [(root, '')]
+        while stack:
+            directory, relpath = stack.pop()
+            names, sub_dirs = scan(directory, relpath)
+            yield directory, relpath, names
+            stack.extend(reversed(sub_dirs))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan, root, ''): (root, '')}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory, relpath = pending.pop(future)
+                names, sub_dirs = future.result()
+                yield directory, relpath, names
+                for sub_dir in sub_dirs:
+                    pending[executor.submit(scan, *sub_dir)] = sub_dir
+
+
+def walk_on_tree(path_list, root_output_dir, recursive=False, include=(), exclude=(), workers=1):
     """Принимает список path-like объектов, и возможную директорию для выходных файлов.
     Флаг recursive устанавливает режим обхода директорий в path_list (если присутствуют).
     На каждой итерации yield возвращает кортеж из двух элементов: медиафайла и выходной директории для этого медиафайла
      в зависимости от аргумента ком.строки 'output'.
+    Расширения сравниваются без учета регистра. include и exclude - шаблоны fnmatch для файлов и директорий
+    внутри входных директорий (см. match_rules); явно переданные файлы не фильтруются.
+    Пары возвращаются по мере обхода, поэтому задачи можно запускать до его окончания.
     """
-    glob_pattern = '**/*' if recursive else '*'
+    include = tuple(pattern.lower() for pattern in include or ())
+    exclude = tuple(pattern.lower() for pattern in exclude or ())
     for path in path_list:
-        if path.exists():
-            if path.is_file() and path.suffix.lower().endswith(MEDIA_FORMAT):
-                output_dir = path.parent if root_output_dir is None else root_output_dir
-                yield path, output_dir
-            elif path.is_dir():
-                output_dir = path if root_output_dir is None else root_output_dir
-                yield from ((media, output_dir.joinpath(media.parent.relative_to(path)))
-                            for media in itertools.chain.from_iterable(path.glob(glob_pattern + ext)
-                            for ext in MEDIA_FORMAT))
+        if path.is_file():
+            if path.suffix.lower() in MEDIA_FORMAT:
+                yield path, path.parent if root_output_dir is None else root_output_dir
+        elif path.is_dir():
+            output_dir = path if root_output_dir is None else root_output_dir
+            for directory, relpath, names in scan_tree(str(path), recursive, include, exclude, workers):
+                for name in names:
+                    yield Path(directory, name), output_dir.joinpath(relpath)
         else:
             print('{} - not exists! Skip.'.format(str(path)))
 
 
-sort_pattern = re.compile(r"(\d+)")
-
-
-def native_sort(path):
-    result = []
-    for part in path.parts:
-        for x in re.split(sort_pattern, part):
-            if not x:
-                continue
-            if x.isdigit() and len(x) < 16:
-                x = "{:0=16}".format(int(x))
-            result.append(x)
-    return result
-
-
-def sorted_glob_with_prefix(pathlike_dir, prefix=''):
-    for ext in IMAGE_FORMAT:
-        yield from sorted(pathlike_dir.glob('{}*.{}'.format(prefix, ext)), key=native_sort)
+# filters - функция от номера кадра, с которого начинается декодирование (при продолжении прерванной задачи).
+# unit - чем является номер в имени файла: 'frame' (номер кадра с 1) или 'ms' (время в миллисекундах).
+# splittable - выборка зависит только от номера кадра, поэтому ветвь можно извлекать по отрезкам видео параллельно
+Output = namedtuple('Output', ('name', 'filters', 'options', 'unit', 'splittable'))
 
 
 class ExtractionTask:
 
-    def __init__(self, media, root_dir, frame_format='png'):
+    def __init__(self, media, root_dir, frame_format='png', threads=0, seek='auto', info=None, profile='balanced',
+                 quality=None, segments=1, progress=None, metrics=None, backend='files', shard_size=SHARD_SIZE):
         if not isinstance(media, Path) and isinstance(media, str):
             media = Path(media)
         if not (media.exists() and media.is_file()):
             raise FileNotFoundError(str(media))
         if not isinstance(root_dir, Path) and isinstance(root_dir, str):
             root_dir = Path(root_dir)
+        if not isinstance(threads, int):
+            raise TypeError('Keyword argument "threads" has unexpected type: {}'.format(type(threads)))
+        elif threads < 0:
+            raise ValueError('Threads < 0')
+        if seek not in SEEK_MODES:
+            raise ValueError('Unknown seek mode: {}'.format(seek))
+        if not isinstance(segments, int):
+            raise TypeError('Keyword argument "segments" has unexpected type: {}'.format(type(segments)))
+        elif segments < 1:
+            raise ValueError('Segments < 1')
+        if backend not in OUTPUT_BACKENDS:
+            raise ValueError('Unknown output backend: {}'.format(backend))
 
         self.__id = uuid.uuid4()
         self.__media = media
         self.__output_dir = root_dir / self.__media.stem
         self.__output_dir.mkdir(parents=True, exist_ok=True)
         self.__ext = frame_format
-        self.__fps = self.get_fps(self.media)
+        self.__encoder_options = tuple(encoder_options(frame_format, profile, quality))
+        self.__threads = threads
+        self.__seek = seek
+        self.__segments = segments
+        self.__progress = progress
+        self.__metrics = metrics
+        self.__backend = backend
+        self.__shard_size = shard_size
+        self.__info = self.get_info(self.media) if info is None else info
+        self.__previous = self.load_checkpoint()
+        self.__checkpoint = {}
 
+        self.__outputs = []
         self.__actions = []
         self.__post_actions = []
 
     @property
     def fps(self):
-        return self.__fps
+        return None if self.__info is None else self.__info.fps
 
     @property
     def id(self):
@@ -108,9 +329,276 @@ class ExtractionTask:
     def ext(self):
         return self.__ext
 
+    @property
+    def encoder_options(self):
+        return self.__encoder_options
+
+    @property
+    def threads(self):
+        return self.__threads
+
+    @property
+    def seek(self):
+        return self.__seek
+
+    @property
+    def segments(self):
+        return self.__segments
+
+    @property
+    def progress(self):
+        """ProgressReporter, которому процессы ffmpeg задачи сообщают прогресс (None - прогресс не собирается)."""
+        return self.__progress
+
+    @property
+    def metrics(self):
+        """TaskMetrics, в которые записывается время процессов ffmpeg и постобработки (None - не собираются)."""
+        return self.__metrics
+
+    @property
+    def backend(self):
+        """Куда пишутся кадры (см. modules/shards.py): ffmpeg всегда пишет файлы, tar и pack упаковывают их в архив."""
+        return self.__backend
+
+    @property
+    def shard_size(self):
+        return self.__shard_size
+
+    @property
+    def total_frames(self):
+        if self.__info is None:
+            return None
+        if self.__info.nb_frames:
+            return self.__info.nb_frames
+        return None if not self.fps or not self.duration else int(round(self.duration * self.fps))
+
+    @property
+    def info(self):
+        return self.__info
+
+    @property
+    def duration(self):
+        return None if self.__info is None else self.__info.duration
+
+    @property
+    def keyframe_interval(self):
+        if self.__info is None:
+            return None
+        return get_keyframe_interval(self.media, self.__info)
+
+    @property
+    def outputs(self):
+        return tuple(self.__outputs)
+
+    def add_output(self, name, filters, options=(), unit='frame', splittable=True):
+        """Добавляет ветвь в общий граф фильтров: все ветви задачи получают кадры от одного декодирования.
+        Ветвь без фильтров (filters=None) только резервирует выходную директорию, кадры в нее пишет отдельное действие.
+        splittable=False - выборка зависит от предыдущих кадров, и ветвь всегда декодирует видео одним процессом.
+        """
+        if any(output.name == name for output in self.__outputs):
+            raise ValueError('Output "{}" already exists in task'.format(name))
+        if filters is not None and not callable(filters):
+            raise TypeError('Filters must be callable')
+        self.__outputs.append(Output(name, filters, tuple(options), unit, splittable))
+
+    def get_output(self, name):
+        return next(output for output in self.__outputs if output.name == name)
+
+    def output_path(self, name):
+        """Единственная ветвь пишет кадры в output_dir, каждая из нескольких ветвей - в свою поддиректорию."""
+        if len(self.__outputs) <= 1:
+            return self.output_dir
+        return self.output_dir / name
+
+    def command(self, decoded=None, start=0, end=None, threads=None):
+        """Команда ffmpeg с общим графом фильтров: split раздает декодированные кадры по ветвям select.
+        Каждая ветвь выставляет pts кадра равным его итоговому номеру, и -frame_pts сразу пишет файл с нужным именем.
+        start > 0 - номер кадра, с которого продолжается прерванное извлечение или начинается отрезок видео
+        (вход перематывается через -ss). end - номер кадра, на котором отрезок заканчивается (не включая его, -to).
+        Если задача собирает прогресс, первым выходом идет null: по нему ffmpeg считает декодированные кадры.
+        threads ограничивает декодер, граф фильтров и кодировщики: иначе каждый из одновременно запущенных
+        ffmpeg создает по потоку декодирования и фильтров на каждое ядро.
+        """
+        threads = self.threads if threads is None else threads
+        if decoded is None:
+            decoded = [output for output in self.__outputs if output.filters is not None]
+        if len(decoded) > 1:
+            inputs = ['s{}'.format(i) for i in range(len(decoded))]
+            graph = ['[0:v]split={}{}'.format(len(inputs), ''.join('[{}]'.format(x) for x in inputs))]
+        else:
+            inputs = ['0:v']
+            graph = []
+
+        outputs = [] if self.progress is None else ['-map', '0:v:0', '-f', 'null', '-']
+        for i, output in enumerate(decoded):
+            graph.append('[{}]{}[o{}]'.format(inputs[i], output.filters(start), i))
+            outputs.extend(['-map', '[o{}]'.format(i), '-threads', str(threads)])
+            outputs.extend(output.options)
+            outputs.extend(self.encoder_options)
+            outputs.extend(['-vsync', 'vfr', '-enc_time_base', '1', '-frame_pts', '1'])
+            if self.backend != 'files':
+                # Упаковщик забирает в архив файлы с итоговым именем: они должны появляться уже записанными
+                outputs.extend(['-atomic_writing', '1'])
+            outputs.append(str(self.output_path(output.name) / '%0{}d.{}'.format(FRAME_NUMBER_WIDTH, self.ext)))
+
+        # Перемотка на полкадра раньше (см. seek_position): первым декодированным кадром будет кадр start
+        seek = ['-ss', seek_position(start / self.fps, self.fps)] if start > 0 else []
+        if end is not None:
+            seek.extend(['-to', seek_position(end / self.fps, self.fps)])
+        return [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-threads', str(threads), *seek,
+            '-i', str(self.media), '-filter_complex_threads', str(threads), '-filter_complex', ';'.join(graph),
+        ] + outputs
+
+    def decode(self):
+        decoded = [output for output in self.__outputs
+                   if output.filters is not None and not self.is_done(output.name)]
+        if not decoded:
+            return None
+        for output in decoded:
+            self.output_path(output.name).mkdir(parents=True, exist_ok=True)
+        bounds = self.segment_bounds() if any(output.splittable for output in decoded) else None
+        if bounds is None:
+            start = min(self.resume_frame(output) for output in decoded)
+            if start > 0:
+                print('Resume from frame {}: {}'.format(start, str(self.media)))
+            return self.run_commands([(start, self.command(decoded, start), self.frames_between(start))])[0]
+
+        # Каждый отрезок извлекается своим процессом ffmpeg; номера кадров в именах файлов сквозные,
+        # поэтому результат совпадает с извлечением одним процессом. Остальные ветви декодируют видео целиком
+        splittable = [output for output in decoded if output.splittable]
+        rest = [output for output in decoded if not output.splittable]
+        threads = max(1, (self.threads or os.cpu_count() or 1) // (len(bounds) - 1))
+        commands = [(start, self.command(splittable, start, end, threads), self.frames_between(start, end))
+                    for start, end in zip(bounds, bounds[1:])]
+        if rest:
+            start = min(self.resume_frame(output) for output in rest)
+            commands.append(('full', self.command(rest, start, threads=threads), self.frames_between(start)))
+        print('Extract {} segments in parallel: {}'.format(len(bounds) - 1, str(self.media)))
+        results = self.run_commands(commands)
+        return next((result for result in results if result.returncode != 0), results[0])
+
+    def frames_between(self, start, end=None):
+        """Количество кадров, которые декодирует процесс с start по end (None - до конца видео)."""
+        if end is None:
+            end = self.total_frames
+        return None if end is None else max(0, end - start)
+
+    def run_commands(self, commands):
+        """Выполняет команды ffmpeg, несколько - параллельно. commands - список (процесс, команда, количество
+        кадров), процесс - ключ, под которым его прогресс сообщается в progress. Возвращает результаты по порядку.
+        """
+        if self.progress is not None:
+            self.progress.start(self.id, str(self.media), {part: total for part, _, total in commands})
+
+        def run(command):
+            part, cmd, _ = command
+            return run_ffmpeg(cmd, None if self.progress is None else partial(self.progress.update, self.id, part),
+                              self.metrics)
+
+        if len(commands) == 1:
+            return [run(commands[0])]
+        with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+            return list(executor.map(run, commands))
+
+    def segment_bounds(self):
+        """Номера кадров, на которых начинаются отрезки параллельного извлечения, и None - конец видео.
+        Видео делится на segments равных по времени частей, каждая граница сдвигается к ключевому кадру не позже нее:
+        отрезок начинается с ключевого кадра, и перемотка к нему не требует декодирования соседнего отрезка.
+        Если видео не удается разделить (нет fps, длительности или ключевых кадров), возвращает None.
+        """
+        if self.segments <= 1 or not self.fps or not self.duration:
+            return None
+        timestamps = [self.duration * i / self.segments for i in range(1, self.segments)]
+        starts = segment_starts(get_keyframes(self.media, timestamps), self.fps)
+        if not starts:
+            return None
+        return [0] + starts + [None]
+
+    def load_checkpoint(self):
+        try:
+            with (self.output_dir / CHECKPOINT_FILE).open() as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        stat = self.media.stat()
+        if checkpoint.get('media') != [str(self.media.absolute()), stat.st_size, stat.st_mtime_ns]:
+            return {}
+        return checkpoint.get('outputs', {})
+
+    def save_checkpoint(self, state):
+        """Записывает состояние ветвей: running - извлечение идет, partial - прервано (с номером последнего
+        записанного кадра), done - завершено. Завершенные ранее ветви не переписываются.
+        """
+        for output in self.__outputs:
+            if self.is_done(output.name):
+                self.__checkpoint[output.name] = self.__previous[output.name]
+                continue
+            self.__checkpoint[output.name] = {
+                'params': self.output_params(output),
+                'state': state,
+                'high_water_mark': self.high_water_mark(output.name) if state == 'partial' else None,
+                'segments': self.segments if output.splittable else 1,
+            }
+        stat = self.media.stat()
+        checkpoint = {
+            'media': [str(self.media.absolute()), stat.st_size, stat.st_mtime_ns],
+            'outputs': self.__checkpoint,
+        }
+        path = self.output_dir / CHECKPOINT_FILE
+        try:
+            with path.with_suffix('.tmp').open('w') as f:
+                json.dump(checkpoint, f, indent=4)
+            path.with_suffix('.tmp').replace(path)
+        except OSError as err:
+            print(err)
+
+    def output_params(self, output):
+        """Параметры ветви в контрольной точке. Директория кадров входит в них: единственная ветвь пишет в output_dir,
+        а при добавлении других ветвей та же ветвь пишет в поддиректорию, где ее кадров еще нет.
+        """
+        params = [None if output.filters is None else output.filters(0), list(output.options + self.encoder_options),
+                  self.ext, os.path.relpath(str(self.output_path(output.name)), str(self.output_dir))]
+        return params if self.backend == 'files' else params + [self.backend]
+
+    def is_done(self, name):
+        entry = self.__previous.get(name)
+        return (entry is not None and entry.get('state') == 'done'
+                and entry.get('params') == self.output_params(self.get_output(name)))
+
+    def high_water_mark(self, name):
+        """Наибольший номер кадра среди файлов и кадров архива ветви (None, если кадров нет)."""
+        numbers = list(read_index(self.output_path(name)))
+        try:
+            with os.scandir(str(self.output_path(name))) as entries:
+                numbers.extend(int(entry.name.split('.')[0]) for entry in entries
+                               if entry.name.endswith('.' + self.ext) and entry.name.split('.')[0].isdigit())
+        except OSError:
+            pass
+        return max(numbers, default=None)
+
+    def resume_frame(self, output):
+        """Номер кадра видео, с которого продолжается прерванная ветвь; 0 - ветвь начинается с начала.
+        Последний записанный файл мог быть записан не полностью, поэтому он извлекается заново.
+        """
+        entry = self.__previous.get(output.name)
+        if entry is None or entry.get('state') not in ('running', 'partial') \
+                or entry.get('params') != self.output_params(output):
+            return 0
+        # Отрезки пишут кадры не по порядку: по наибольшему номеру нельзя определить, что уже извлечено
+        if entry.get('segments', 1) > 1:
+            return 0
+        mark = entry.get('high_water_mark') if entry.get('state') == 'partial' else None
+        if mark is None:
+            mark = self.high_water_mark(output.name)
+        if mark is None or not self.fps:
+            return 0
+        return max(0, mark - 1) if output.unit == 'frame' else int(round(mark * self.fps / 1000))
+
     @property
     def actions(self):
-        return tuple(self.__actions)
+        decode = (self.decode,) if any(output.filters is not None for output in self.__outputs) else ()
+        return decode + tuple(self.__actions)
 
     def add_actions(self, *args):
         if not all(map(callable, args)):
@@ -135,14 +623,16 @@ class ExtractionTask:
     def __str__(self):
         return '\n'.join(
             ('ExtractionTask:', 'ID: '+str(self.id), 'MEDIA: '+str(self.media), 'OUTPUT_DIR: '+str(self.output_dir),
-             'IMAGE_FORMAT: '+self.ext,
+             'IMAGE_FORMAT: '+self.ext, 'ENCODER: '+' '.join(self.encoder_options), 'THREADS: '+str(self.threads),
+             ('\n'+' '*4).join(['Outputs:'] + [output.name for output in self.outputs]),
              ('\n'+' '*4).join(map(str, ['Actions:'] + list(self.actions))),
              ('\n'+' '*4).join(map(str, ['Postprocess:'] + list(self.post_actions)))
              )
         )
 
     @staticmethod
-    def get_fps(media):
+    def get_info(media):
+        """Метаданные видеофайла (кэшируются на диске, см. modules/probe.py)."""
         if not isinstance(media, Path) and isinstance(media, str):
             media = Path(media)
         if not (media.exists() and media.is_file()):
@@ -150,22 +640,12 @@ class ExtractionTask:
         if media.suffix.lower() not in MEDIA_FORMAT:
             print('Unsupported MEDIA_FORMAT: {}'.format(media.suffix))
             return None
-        try:
-            ffprobe_output = sp.check_output(
-                [
-                 'ffprobe', '-v', '0', '-of', 'csv=p=0', '-select_streams', 'v:0',
-                 '-show_entries', 'stream=r_frame_rate', str(media),
-                ]
-            )
-
-            fps = float(eval(ffprobe_output.decode('utf8').strip('\n')))
-        except (sp.CalledProcessError, UnicodeDecodeError, AttributeError) as e:
-            print(e)
-        except (SyntaxError, ValueError) as err:
-            print(err)
-        else:
-            return fps
-        return None
+        return probe(media)
+
+    @staticmethod
+    def get_fps(media):
+        info = ExtractionTask.get_info(media)
+        return None if info is None else info.fps
 
 
 def cut_microseconds_in_dirname(directory):
@@ -180,32 +660,6 @@ def cut_microseconds_in_dirname(directory):
             directory.parent / '_'.join((date, '{}.{}'.format(seconds, milliseconds[:-3]), camera_code)))
 
 
-def correct_filenames(directory, uid, interval=1, is_time_interval=False):
-    if not isinstance(directory, Path):
-        raise TypeError('Positional argument "directory" has unexpected type: {}'.format(type(directory)))
-    elif not (directory.exists() and directory.is_dir()):
-        raise NotADirectoryError(str(directory))
-    if not isinstance(uid, uuid.UUID):
-        raise TypeError('Positional argument "uid" has unexpected type: {}'.format(type(uid)))
-    if not isinstance(interval, int):
-        raise TypeError('Keyword argument "interval" has unexpected type: {}'.format(type(interval)))
-    elif interval <= 0:
-        raise ValueError('Interval <= 0')
-
-    for img in sorted_glob_with_prefix(directory, str(uid) + '_'):
-        try:
-            prefix, index = img.stem.rsplit('_', maxsplit=1)
-            assert str(uid) == prefix, 'Prefix not equal for frame: {}'.format(str(img))
-            assert index.isdigit() is True, 'Frame_number not digit for frame: {}'.format(str(img))
-            index = int(index) - 1
-        except (ValueError, AttributeError):
-            print('Skip: ' + str(img))
-        except AssertionError:
-            print('AssertionError. Skip: ' + str(img))
-        else:
-            img.rename(img.parent / '{}{}'.format(index * interval + (1 if not is_time_interval else 0), img.suffix))
-
-
 # REGISTRATE OPERATIONS TO ACTION_MAP
 ACTION_MAP = {}
 
@@ -220,6 +674,13 @@ def register_operation(operation_name):
     return wrapper
 
 
+def dedup_outputs(task, distance, mode='remove', method='dhash'):
+    """Постобработка задачи: убирает похожие кадры в каждой выходной директории."""
+    for output in task.outputs:
+        if task.output_path(output.name).is_dir():
+            dedup.prune_duplicates(task.output_path(output.name), task.ext, distance, mode, method, task.threads)
+
+
 @register_operation('frame_interval')
 def extract_by_frame_interval(task, frame_interval=1):
     if not isinstance(frame_interval, int):
@@ -231,17 +692,10 @@ def extract_by_frame_interval(task, frame_interval=1):
         print("Can't get FPS from: {}".format(str(task.media)))
         return
 
-    cmd = [
-        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', str(task.media), '-threads', '0', '-crf', '0', '-preset', 'veryslow',
-        '-vf', "select=not(mod(n\\,{}))".format(frame_interval), '-vsync', 'vfr',
-        str(task.output_dir / "{}_%d.{}".format(str(task.id), task.ext)),
-    ]
-
-    task.add_actions(
-        partial(sp.run, cmd),
-    )
-    task.add_post_actions(
-        partial(correct_filenames, task.output_dir, task.id, interval=frame_interval, is_time_interval=False),
+    task.add_output(
+        'frame_interval_{}'.format(frame_interval),
+        partial(frame_interval_branch, frame_interval),
+        unit='frame',
     )
 
 
@@ -256,58 +710,486 @@ def extract_by_time_interval(task, time_interval=1):
         print("Can't get FPS from: {}".format(str(task.media)))
         return
 
-    cmd = [
-        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', str(task.media), '-threads', '0', '-crf', '0', '-preset', 'veryslow',
-        '-vf', "select=between(mod(n\\, {0})\\, 0\\, 0), setpts=N/{1}/TB".format(task.fps*time_interval/1000, task.fps),
-        str(task.output_dir / '{}_%d.{}'.format(str(task.id), task.ext)),
-    ]
+    name = 'time_interval_{}ms'.format(time_interval)
+    if use_seeking(task, time_interval):
+        # Те же кадры и имена, что и при декодировании: метка k (имя k * интервал) - первый кадр n не раньше нее
+        total = task.total_frames
+        targets = []
+        for k, n in time_interval_indices(task.fps, time_interval):
+            if k * time_interval >= task.duration * 1000 or (total is not None and n >= total):
+                break
+            targets.append((k * time_interval, n / task.fps))
+        task.add_output(name, None, unit='ms')
+        task.add_actions(partial(extract_by_seeking, task, name, targets))
+        return
 
-    task.add_actions(
-        partial(sp.run, cmd),
-    )
-    task.add_post_actions(
-        partial(correct_filenames, task.output_dir, task.id, interval=time_interval, is_time_interval=True),
+    task.add_output(
+        name,
+        partial(time_interval_branch, task.fps, time_interval),
+        unit='ms',
     )
 
 
+def segment_starts(keyframes, fps):
+    """Номера первых кадров отрезков по ключевым кадрам у границ (в секундах). Кадр 0 и повторы отбрасываются."""
+    return sorted(set(round(keyframe * fps) for keyframe in keyframes) - {0})
+
+
+def seek_position(seconds, fps):
+    """Значение -ss/-to для кадра со временем seconds: на полкадра раньше, поэтому первым после перемотки
+    декодируется именно этот кадр, а -to останавливается перед ним, даже если время кадра округлено.
+    """
+    return '{:.6f}'.format(max(0.0, seconds - 0.5 / fps))
+
+
+def frame_interval_first(frame_interval, start):
+    """Номер первого кадра не раньше start, который отбирает frame_interval (кратный шагу)."""
+    return -(-start // frame_interval) * frame_interval
+
+
+def frame_offset(start):
+    return '+{}'.format(start) if start else ''
+
+
+def frame_interval_filter(frame_interval, start=0):
+    return "select=not(mod(n{}\\,{}))".format(frame_offset(start), frame_interval)
+
+
+def time_interval_filter(fps, time_interval, start=0):
+    """Кадр n отбирается, если на него приходится метка k: n-1 < k*step <= n, т.е. floor(n/step) > floor((n-1)/step).
+    Шаг - точная дробь, поэтому выражение считается в целых числах и не зависит от погрешности fps.
+    """
+    step = time_interval_step(fps, time_interval)
+    return "select=gt(floor((n{0})*{2}/{1})\\,floor((n{0}-1)*{2}/{1}))".format(
+        frame_offset(start), step.numerator, step.denominator)
+
+
+def frame_interval_branch(frame_interval, start=0):
+    """Ветвь графа для frame_interval: имя кадра - его номер в видео, начиная с 1."""
+    first = frame_interval_first(frame_interval, start)
+    return frame_interval_filter(frame_interval, start) + ",settb=1,setpts=N*{}+{}".format(frame_interval, first + 1)
+
+
+def scene_filter(threshold, min_gap=0, max_gap=None):
+    """select по оценке смены сцены; интервалы - в кадрах. prev_selected_n до первого отобранного кадра - NAN."""
+    gap = 'n-prev_selected_n'
+    expression = 'gte(scene\\,{})'.format(threshold)
+    if min_gap:
+        expression = '{}*gte({}\\,{})'.format(expression, gap, min_gap)
+    if max_gap is not None:
+        expression = 'max({}\\,gte({}\\,{}))'.format(expression, gap, max_gap)
+    return "select=if(isnan(prev_selected_n)\\,1\\,{})".format(expression)
+
+
+def scene_branch(threshold, min_gap=0, max_gap=None, start=0):
+    """Ветвь графа для scene: pts выставляется до select, поэтому имя кадра - его номер в видео, начиная с 1."""
+    return "settb=1,setpts=N+{},".format(start + 1) + scene_filter(threshold, min_gap, max_gap)
+
+
+def time_interval_branch(fps, time_interval, start=0):
+    """Ветвь графа для time_interval: имя кадра - время его метки в миллисекундах (см. time_interval_mark).
+    pts выставляется до select по номеру кадра в видео, поэтому отрезок не зависит от предыдущих.
+    """
+    step = time_interval_step(fps, time_interval)
+    return "settb=1,setpts=max(0\\,floor((N{0}-1)*{2}/{1})+1)*{3},".format(
+        frame_offset(start), step.numerator, step.denominator, time_interval) + \
+        time_interval_filter(fps, time_interval, start)
+
+
+def time_interval_step(fps, time_interval):
+    """Шаг между метками в кадрах (fps * интервал) точной дробью: частота восстанавливается из float fps."""
+    return Fraction(fps).limit_denominator(FPS_MAX_DENOMINATOR) * time_interval / 1000
+
+
+def time_interval_mark(step, n):
+    """Номер первой метки, которая приходится на отобранный кадр n (n-1 < k*step <= n)."""
+    return max(0, math.floor((n - 1) / step) + 1)
+
+
+def time_interval_indices(fps, time_interval):
+    """(k, n) по возрастанию: метка k (время k * интервал) и кадр n, который ее представляет, - первый кадр
+    не раньше метки, n = ceil(k*step). Если метки чаще кадров, на кадр приходится несколько меток, и он
+    выдается один раз - с первой из них (как имя кадра в time_interval_branch).
+    """
+    step = time_interval_step(fps, time_interval)
+    previous = None
+    for k in itertools.count():
+        n = math.ceil(k * step)
+        if n != previous:
+            previous = n
+            yield k, n
+
+
+def use_seeking(task, time_interval):
+    """Выбор между перемоткой к каждой метке времени и полным декодированием видео."""
+    if task.seek == 'never':
+        return False
+    if task.duration is None:
+        print("Can't get duration from: {}. Seeking disabled.".format(str(task.media)))
+        return False
+    if task.seek == 'always':
+        return True
+    if task.keyframe_interval is None:
+        return False
+    return time_interval / 1000 >= max(SEEK_MIN_INTERVAL, SEEK_GOP_FACTOR * task.keyframe_interval)
+
+
+def extract_by_seeking(task, name, targets):
+    """Извлекает по одному кадру на каждую цель (имя кадра в мс, время кадра в секундах): ffmpeg перематывает
+    вход (-ss перед -i) к ближайшему ключевому кадру и декодирует только до нужного кадра.
+    Перемотка идет на полкадра раньше (см. seek_position): первым будет нужный кадр.
+    Цели обрабатываются параллельно.
+    """
+    if task.is_done(name):
+        return None
+    output_dir = task.output_path(name)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Файлы пишутся атомарно (-atomic_writing), поэтому при продолжении уже существующие кадры пропускаются
+    archived = read_index(output_dir)
+    frames = ((seconds, output_dir / '{:0{}d}.{}'.format(timestamp, FRAME_NUMBER_WIDTH, task.ext))
+              for timestamp, seconds in targets if timestamp not in archived)
+    commands = [
+        [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+            '-threads', '1', '-ss', seek_position(seconds, task.fps), '-i', str(task.media),
+            '-threads', '1', '-frames:v', '1', *task.encoder_options, '-update', '1', '-atomic_writing', '1',
+            str(frame),
+        ]
+        for seconds, frame in frames if not frame.exists()
+    ]
+
+    if not commands:
+        return None
+    if task.progress is not None:
+        task.progress.start(task.id, str(task.media), {name: len(commands)})
+    results = []
+    with ThreadPoolExecutor(max_workers=task.threads or os.cpu_count() or 1) as executor:
+        for result in executor.map(partial(run_ffmpeg, metrics=task.metrics), commands):
+            results.append(result)
+            if task.progress is not None:
+                task.progress.update(task.id, name, {'frame': len(results)})
+
+    return next((result for result in results if result.returncode != 0), results[-1] if results else None)
+
+
+@register_operation('scene')
+def extract_by_scene(task, scene=(0.3, 0.0, None)):
+    """Кадры, на которых меняется сцена (оценка scene фильтра select не меньше порога), не чаще min_gap
+    и не реже max_gap секунд. Первый кадр видео извлекается всегда. Имя кадра - его номер в видео, начиная с 1.
+    """
+    threshold, min_gap, max_gap = scene
+    if not 0 <= threshold <= 1:
+        raise ValueError('Scene threshold must be in range 0-1')
+    if min_gap < 0 or (max_gap is not None and max_gap <= min_gap):
+        raise ValueError('Scene gaps must satisfy 0 <= min_gap < max_gap')
+
+    if task.fps is None:
+        print("Can't get FPS from: {}".format(str(task.media)))
+        return
+
+    name = 'scene_{:g}'.format(threshold)
+    if min_gap:
+        name += '_min{:g}s'.format(min_gap)
+    if max_gap is not None:
+        name += '_max{:g}s'.format(max_gap)
+    # Интервалы переводятся в кадры: select сравнивает номера кадров
+    min_frames = round(min_gap * task.fps)
+    max_frames = None if max_gap is None else max(1, round(max_gap * task.fps))
+    task.add_output(name, partial(scene_branch, threshold, min_frames, max_frames), unit='frame', splittable=False)
+
+
 @register_operation('extract_all')
 def extract_all(task, *args):
     extract_by_frame_interval(task)
 
-    
+
+def read_exact(stream, view):
+    """Заполняет view данными из stream целиком. Возвращает False, если поток закончился раньше."""
+    while view:
+        count = stream.readinto(view)
+        if not count:
+            return False
+        view = view[count:]
+    return True
+
+
+def iter_frames(media, frame_interval=None, time_interval=None, buffers=4, threads=0):
+    """Декодирует кадры в память без записи на диск: yield возвращает кортеж (номер кадра, pts в секундах,
+    массив numpy формы (height, width, 3) в RGB). Номер кадра начинается с 1, как в именах файлов frame_interval.
+    Выборка совпадает с операциями ACTION_MAP: frame_interval - шаг в кадрах, time_interval - в миллисекундах,
+    без обоих аргументов возвращаются все кадры.
+
+    Кадры читаются из канала ffmpeg прямо в кольцо из buffers заранее выделенных массивов, без копирования.
+    Массив перезаписывается через buffers итераций: чтобы сохранить кадр дольше, его нужно скопировать.
+    Пока потребитель не забрал кадр, ffmpeg блокируется на записи в канал, поэтому память ограничена.
+    """
+    if np is None:
+        raise ImportError('iter_frames requires numpy')
+    if frame_interval is not None and time_interval is not None:
+        raise ValueError('Only one of frame_interval and time_interval can be set')
+    if not isinstance(buffers, int) or buffers < 1:
+        raise ValueError('Buffers must be INT >= 1')
+    if not isinstance(media, Path) and isinstance(media, str):
+        media = Path(media)
+    if not (media.exists() and media.is_file()):
+        raise FileNotFoundError(str(media))
+
+    info = ExtractionTask.get_info(media)
+    if info is None or info.fps is None or not info.width or not info.height:
+        raise ValueError("Can't get FPS or frame size from: {}".format(str(media)))
+    fps, width, height = info.fps, info.width, info.height
+
+    if time_interval is not None:
+        if not isinstance(time_interval, int) or time_interval < 1:
+            raise ValueError('Time interval must be INT >= 1')
+        select = time_interval_filter(fps, time_interval)
+        indices = (n for _, n in time_interval_indices(fps, time_interval))
+    else:
+        frame_interval = 1 if frame_interval is None else frame_interval
+        if not isinstance(frame_interval, int) or frame_interval < 1:
+            raise ValueError('Frame interval must be INT >= 1')
+        select = frame_interval_filter(frame_interval)
+        indices = itertools.count(0, frame_interval)
+
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-threads', str(threads), '-i', str(media),
+        '-threads', str(threads), '-filter_threads', str(threads), '-vf', select, '-vsync', 'vfr',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1',
+    ]
+
+    frames = np.empty((buffers, height, width, 3), dtype=np.uint8)
+    process = sp.Popen(cmd, stdout=sp.PIPE, bufsize=0)
+    try:
+        for i, index in enumerate(indices):
+            frame = frames[i % buffers]
+            if not read_exact(process.stdout, memoryview(frame).cast('B')):
+                break
+            yield index + 1, index / fps, frame
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+    if process.returncode != 0:
+        raise sp.CalledProcessError(process.returncode, cmd)
+
+
+def get_jobs(jobs, tasks_count):
+    """Количество одновременно выполняемых задач: jobs <= 0 - по числу ядер, но не больше числа задач."""
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    return max(1, min(jobs, tasks_count))
+
+
+def thread_budget(jobs):
+    """Делит ядра между одновременно запущенными ffmpeg, чтобы не перегружать процессор.
+    Для единственной задачи ffmpeg сам выбирает число потоков (-threads 0).
+    """
+    if jobs <= 1:
+        return 0
+    return max(1, (os.cpu_count() or 1) // jobs)
+
+
+def run_task(task):
+    """Выполняет задачу (см. run_actions) и сообщает о ее завершении в task.progress и task.metrics."""
+    directories = [task.output_path(output.name) for output in task.outputs]
+    if task.metrics is not None:
+        task.metrics.start(directories, task.ext)
+    status = run_actions(task)
+    if task.metrics is not None:
+        task.metrics.finish(directories, task.ext, status)
+    if task.progress is not None:
+        task.progress.finish(task.id, status)
+    return status
+
+
+def run_actions(task):
+    """Выполняет действия задачи, затем ее постобработку. Возвращает код завершения.
+    Постобработка запускается только если все действия задачи завершились успешно.
+    """
+    if not task.actions:
+        print('No actions for: {}'.format(str(task.media)))
+        return 1
+    if task.outputs and all(task.is_done(output.name) for output in task.outputs):
+        print('Already extracted, skip: {}'.format(str(task.media)))
+        return 0
+
+    task.save_checkpoint('running')
+    status = 0
+    with packing([task.output_path(output.name) for output in task.outputs], task.ext, task.backend,
+                 task.shard_size):
+        for action in task.actions:
+            try:
+                result = action()
+            except (OSError, sp.SubprocessError) as err:
+                print(err)
+                status = 1
+                break
+            if isinstance(result, sp.CompletedProcess) and result.returncode != 0:
+                print('ffmpeg exited with code {}: {}'.format(result.returncode, str(task.media)))
+                status = result.returncode
+                break
+    if status != 0:
+        # Номер последнего кадра определяется после упаковки: в архив попадают только полностью записанные кадры
+        task.save_checkpoint('partial')
+        return status
+
+    if task.metrics is not None:
+        task.metrics.count_written([task.output_path(output.name) for output in task.outputs], task.ext)
+    start = time.perf_counter()
+    for action in task.post_actions:
+        try:
+            action()
+        except (OSError, TypeError, ValueError) as err:
+            print(err)
+            task.save_checkpoint('partial')
+            return 1
+        finally:
+            if task.metrics is not None:
+                task.metrics.add_post(time.perf_counter() - start)
+                start = time.perf_counter()
+    task.save_checkpoint('done')
+    return 0
+
+
+def iter_tasks(batches, make_task):
+    """Создает задачи по пачкам найденных медиафайлов: каждая пачка опрашивается одним вызовом probe_many,
+    поэтому первые задачи запускаются до окончания обхода входных директорий.
+    make_task(медиафайл, выходная директория, MediaInfo, время опроса) - время опроса пачки делится поровну.
+    """
+    for batch in batches:
+        if not batch:
+            continue
+        start = time.perf_counter()
+        infos = probe_many([media for media, _ in batch])
+        probe_time = (time.perf_counter() - start) / len(batch)
+        for media, output_dir in batch:
+            yield make_task(media, output_dir, infos.get(media), probe_time)
+
+
+def run_tasks(tasks, jobs=1, scheduler=None):
+    """Выполняет задачи в пуле из jobs потоков (каждый поток управляет своим процессом ffmpeg).
+    Задачи берутся из итерируемого объекта по мере освобождения потоков (в очереди не больше 2 * jobs),
+    поэтому он может быть генератором, который еще обходит входные директории.
+    scheduler - AdaptiveScheduler, который подбирает количество задач сам (jobs не используется).
+    Возвращает 0, если все задачи завершились успешно, иначе 1.
+    """
+    if scheduler is not None:
+        failed = scheduler.run(tasks, run_task)
+        for task in failed:
+            print('Failed: {}'.format(str(task.media)))
+        return 1 if failed else 0
+
+    tasks = iter(tasks)
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {executor.submit(run_task, task): task for task in itertools.islice(tasks, 2 * jobs)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                if future.result() != 0:
+                    failed.append(task)
+            pending.update((executor.submit(run_task, task), task) for task in itertools.islice(tasks, len(done)))
+
+    for task in failed:
+        print('Failed: {}'.format(str(task.media)))
+    return 1 if failed else 0
+
+
 def main(parsed_args=None):
     if parsed_args is None:
         return
 
-    arg_list = [attr for attr in (ACTION_MAP.keys() & parsed_args.keys()) if parsed_args[attr]]
+    operations = [
+        (ACTION_MAP[attr], value)
+        for attr in ACTION_MAP if parsed_args.get(attr)
+        for value in (parsed_args[attr] if isinstance(parsed_args[attr], list) else [parsed_args[attr]])
+    ]
+
+    if not operations:
+        print(ACTION_MAP.keys())
+        raise ValueError('No action in arguments.')
 
-    if len(arg_list) != 1:
-        print((ACTION_MAP.keys() & parsed_args.keys()))
-        print(arg_list)
-        raise ValueError('Not single action in arguments.')
+    if parsed_args.get('dedup') is not None and (dedup.np is None or dedup.Image is None):
+        print('Frame deduplication requires numpy and Pillow')
+        return 1
+    if parsed_args.get('segments', 1) < 1:
+        print('Segments must be >= 1')
+        return 1
+    backend = parsed_args.get('output_backend', 'files')
+    if parsed_args.get('dedup') is not None and backend != 'files':
+        print('Frame deduplication works only with the files output backend')
+        return 1
+    if parsed_args.get('shard_size', 1) < 1:
+        print('Shard size must be >= 1 MB')
+        return 1
 
-    arg = arg_list.pop()
-    value = parsed_args[arg]
+    output_directory = parsed_args.get('output_directory')
+    sources = walk_on_tree(map(Path, parsed_args['input']),
+                           Path(output_directory) if output_directory else None,
+                           parsed_args['recursive'],
+                           parsed_args.get('include'),
+                           parsed_args.get('exclude'),
+                           parsed_args.get('scan_jobs', 1) or SCAN_WORKERS,
+                           )
+    # Число задач определяется по первым найденным файлам: если их меньше, чем задач может выполняться
+    # одновременно, ядра делятся только между ними; остальные файлы обрабатываются по мере обхода
+    metrics_path, textfile_path = parsed_args.get('metrics'), parsed_args.get('metrics_textfile')
+    report = MetricsReport() if metrics_path or textfile_path else None
+    progress_mode = parsed_args.get('progress', 'text')
+    progress = None if progress_mode == 'off' else ProgressReporter(progress_mode)
+    jobs = parsed_args.get('jobs', 0)
+    adaptive = parsed_args.get('adaptive', False)
+    if adaptive:
+        # Верхняя граница задач; начинают по числу ядер, дальше число подбирает планировщик.
+        # Скорость он узнает из прогресса ffmpeg, поэтому прогресс собирается и при --progress off
+        jobs = jobs if jobs > 0 else MAX_JOBS_FACTOR * (os.cpu_count() or 1)
+        progress = progress or ProgressReporter('off')
+    head = list(itertools.islice(sources, get_jobs(jobs, sys.maxsize)))
+    jobs = get_jobs(jobs, len(head))
+    scheduler = None
+    if adaptive:
+        scheduler = AdaptiveScheduler(progress, jobs, start_jobs=get_jobs(0, jobs),
+                                      disk_reserve=parsed_args.get('min_free_disk', 0) * 1024 ** 2)
+    threads = thread_budget(jobs if scheduler is None else scheduler.limit)
 
-    handler = ACTION_MAP[arg]
+    def make_task(media, output_dir, info, probe_time=0.0):
+        task = ExtractionTask(media, output_dir, frame_format=parsed_args['format'], threads=threads,
+                              seek=parsed_args.get('seek', 'auto'), info=info,
+                              profile=parsed_args.get('profile', 'balanced'), quality=parsed_args.get('quality'),
+                              segments=parsed_args.get('segments', 1), progress=progress,
+                              metrics=None if report is None else report.add_task(media, probe_time),
+                              backend=backend,
+                              shard_size=parsed_args.get('shard_size', SHARD_SIZE // 1024 ** 2) * 1024 ** 2)
+        for handler, value in operations:
+            try:
+                handler(task, value)
+            except (TypeError, ValueError) as err:
+                print(err)
+        if parsed_args.get('dedup') is not None:
+            task.add_post_actions(partial(dedup_outputs, task, parsed_args['dedup'],
+                                          parsed_args.get('dedup_mode', 'remove'),
+                                          parsed_args.get('dedup_hash', 'dhash')))
+        return task
 
-    tasks = [
-        ExtractionTask(media, output_dir, frame_format=parsed_args['format'])
-        for media, output_dir in walk_on_tree(map(Path, parsed_args['input']),
-                                              Path(parsed_args['output_directory']),
-                                              parsed_args['recursive'],
-                                              )
-    ]
+    batches = itertools.chain([head], iter(lambda: list(itertools.islice(sources, PROBE_BATCH_SIZE)), []))
+    status = run_tasks(iter_tasks(batches, make_task), jobs, scheduler)
 
-    for task in tasks:
-        handler(task, value)
-        for action in task:
-            action()
+    if report is not None:
+        metrics = report.as_dict()
+        if metrics_path:
+            report.write_json(metrics_path, metrics)
+        if textfile_path:
+            report.write_textfile(textfile_path, metrics)
 
     # Fix broken terminal after ffmpeg completed work
     # https://bugs.launchpad.net/ubuntu/+source/gnome-terminal/+bug/1756952
     # sp.run('reset')
     # print('All tasks done!')
+    return status
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+# Перемещение, удаление и чтение директорий, как и запуск ffprobe, упираются в задержки файловой системы
+# (особенно сетевой), а не в процессор, поэтому потоков больше, чем ядер
+IO_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# Количество файлов, которые поток обрабатывает за одну задачу пула
+IO_BATCH_SIZE = 1000
+
+sort_pattern = re.compile(r"(\d+)")
+
+
+def native_sort(path):
+    """Ключ сортировки путей: числа в частях пути сравниваются как числа (frame_2 раньше frame_10)."""
+    result = []
+    for part in path.parts:
+        for x in re.split(sort_pattern, part):
+            if not x:
+                continue
+            if x.isdigit() and len(x) < 16:
+                x = "{:0=16}".format(int(x))
+            result.append(x)
+    return result
+
+
+def split_batches(items, batch_size=IO_BATCH_SIZE):
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def apply_batch(func, items):
+    """Вызывает func для каждого элемента пачки; ошибки OSError выводятся. Возвращает количество ошибок."""
+    errors = 0
+    for item in items:
+        try:
+            func(item)
+        except OSError as err:
+            print(err)
+            errors += 1
+    return errors
+
+
+def run_batches(func, batches, workers=IO_WORKERS):
+    """Обрабатывает пачки функцией func (пачка -> количество ошибок) в пуле потоков.
+    Возвращает общее количество ошибок.
+    """
+    if not batches:
+        return 0
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as executor:
+        return sum(executor.map(func, batches))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import subprocess as sp
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+from modules.shards import archive_stats
+
+# Префикс метрик в текстовом файле для node-exporter (textfile collector)
+METRIC_PREFIX = 'ffmpeg_wrapper_extract'
+
+
+def wait_process(process):
+    """Ждет завершения процесса. Возвращает код завершения и ресурсы, потраченные именно этим процессом
+    (os.wait4), или None вместо ресурсов, если os.wait4 недоступен (Windows).
+    getrusage(RUSAGE_CHILDREN) суммирует всех завершенных потомков, поэтому при параллельных задачах
+    не позволяет разделить время между ними.
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return process.returncode, rusage
+
+
+def get_ffmpeg_version():
+    try:
+        output = sp.check_output(['ffmpeg', '-hide_banner', '-version']).decode('utf8', 'replace')
+    except (OSError, sp.CalledProcessError) as err:
+        print(err)
+        return 'unknown'
+    words = output.split()
+    return words[2] if len(words) > 2 else 'unknown'
+
+
+def count_files(directories, ext):
+    """Количество и суммарный размер файлов с расширением ext в директориях вместе с кадрами их архивов."""
+    count = size = 0
+    for directory in set(map(str, directories)):
+        archived, archived_size = archive_stats(directory)
+        count += archived
+        size += archived_size
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.' + ext) and entry.is_file():
+                        count += 1
+                        size += entry.stat().st_size
+        except OSError:
+            continue
+    return count, size
+
+
+class TaskMetrics:
+    """Метрики одной задачи извлечения: время опроса видео, время и процессорное время процессов ffmpeg,
+    время постобработки, количество и размер записанных кадров. Процессы ffmpeg одной задачи могут
+    выполняться параллельно, поэтому их время добавляется под блокировкой.
+    """
+
+    def __init__(self, media, probe_time=0.0):
+        self.__lock = threading.Lock()
+        self.__media = str(media)
+        self.__probe_time = probe_time
+        self.__processes = 0
+        self.__ffmpeg_wall = 0.0
+        self.__ffmpeg_user = 0.0
+        self.__ffmpeg_system = 0.0
+        self.__post_time = 0.0
+        self.__wall = 0.0
+        self.__started = None
+        self.__before = (0, 0)
+        self.__frames = None
+        self.__bytes = None
+        self.__status = None
+
+    @property
+    def media(self):
+        return self.__media
+
+    @property
+    def status(self):
+        return self.__status
+
+    def add_ffmpeg(self, wall, rusage=None):
+        """Время одного процесса ffmpeg: wall - от запуска до завершения, rusage - результат os.wait4."""
+        with self.__lock:
+            self.__processes += 1
+            self.__ffmpeg_wall += wall
+            if rusage is not None:
+                self.__ffmpeg_user += rusage.ru_utime
+                self.__ffmpeg_system += rusage.ru_stime
+
+    def add_post(self, elapsed):
+        with self.__lock:
+            self.__post_time += elapsed
+
+    def start(self, directories, ext):
+        """Запоминает кадры, уже лежащие в выходных директориях (при продолжении задачи), и время начала."""
+        self.__before = count_files(directories, ext)
+        self.__started = time.perf_counter()
+
+    def count_written(self, directories, ext):
+        """Считает кадры, записанные ffmpeg: вызывается до постобработки, которая может удалить часть кадров."""
+        count, size = count_files(directories, ext)
+        self.__frames = max(0, count - self.__before[0])
+        self.__bytes = max(0, size - self.__before[1])
+
+    def finish(self, directories, ext, status):
+        self.__wall = time.perf_counter() - self.__started if self.__started is not None else 0.0
+        if self.__frames is None:
+            self.count_written(directories, ext)
+        self.__status = status
+
+    def as_dict(self):
+        with self.__lock:
+            return {
+                'media': self.__media,
+                'status': self.__status,
+                'probe_seconds': round(self.__probe_time, 6),
+                'ffmpeg_processes': self.__processes,
+                'ffmpeg_wall_seconds': round(self.__ffmpeg_wall, 6),
+                'ffmpeg_cpu_user_seconds': round(self.__ffmpeg_user, 6),
+                'ffmpeg_cpu_system_seconds': round(self.__ffmpeg_system, 6),
+                'post_seconds': round(self.__post_time, 6),
+                'wall_seconds': round(self.__wall, 6),
+                'frames': self.__frames or 0,
+                'bytes': self.__bytes or 0,
+                'frames_per_second': round((self.__frames or 0) / self.__wall, 3) if self.__wall > 0 else None,
+            }
+
+
+class MetricsReport:
+    """Метрики всех задач запуска. Пишется в JSON (по задачам и итоги) и в текстовый файл Prometheus
+    для node-exporter (только итоги запуска: метрики по каждому видео дали бы слишком много рядов).
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__tasks = []
+        self.__started = time.time()
+        self.__timer = time.perf_counter()
+
+    def add_task(self, media, probe_time=0.0):
+        metrics = TaskMetrics(media, probe_time)
+        with self.__lock:
+            self.__tasks.append(metrics)
+        return metrics
+
+    def totals(self, tasks):
+        wall = time.perf_counter() - self.__timer
+        totals = {
+            'tasks': len(tasks),
+            'tasks_failed': sum(1 for task in tasks if task['status'] not in (None, 0)),
+            'run_seconds': round(wall, 6),
+        }
+        for key in ('probe_seconds', 'ffmpeg_wall_seconds', 'ffmpeg_cpu_user_seconds', 'ffmpeg_cpu_system_seconds',
+                    'post_seconds', 'frames', 'bytes'):
+            totals[key] = round(sum(task[key] for task in tasks), 6)
+        totals['frames_per_second'] = round(totals['frames'] / wall, 3) if wall > 0 else None
+        return totals
+
+    def as_dict(self):
+        with self.__lock:
+            tasks = [metrics.as_dict() for metrics in self.__tasks]
+        return {
+            'host': socket.gethostname(),
+            'ffmpeg_version': get_ffmpeg_version(),
+            'started': self.__started,
+            'totals': self.totals(tasks),
+            'tasks': tasks,
+        }
+
+    def write_json(self, path, report=None):
+        write_atomic(path, json.dumps(report or self.as_dict(), indent=4))
+
+    def write_textfile(self, path, report=None):
+        """Текстовый формат Prometheus. Файл заменяется атомарно: node-exporter не должен прочитать его наполовину."""
+        report = report or self.as_dict()
+        totals = report['totals']
+        labels = 'ffmpeg_version="{}"'.format(report['ffmpeg_version'].replace('"', ''))
+        metrics = (
+            ('tasks', 'Extraction tasks in the last run', totals['tasks']),
+            ('tasks_failed', 'Failed extraction tasks in the last run', totals['tasks_failed']),
+            ('run_seconds', 'Wall time of the last run', totals['run_seconds']),
+            ('probe_seconds', 'Time spent probing media', totals['probe_seconds']),
+            ('ffmpeg_wall_seconds', 'Wall time of ffmpeg processes', totals['ffmpeg_wall_seconds']),
+            ('ffmpeg_cpu_user_seconds', 'User CPU time of ffmpeg processes', totals['ffmpeg_cpu_user_seconds']),
+            ('ffmpeg_cpu_system_seconds', 'System CPU time of ffmpeg processes',
+             totals['ffmpeg_cpu_system_seconds']),
+            ('post_seconds', 'Time spent in post-actions', totals['post_seconds']),
+            ('frames', 'Frames written in the last run', totals['frames']),
+            ('bytes', 'Bytes written in the last run', totals['bytes']),
+            ('frames_per_second', 'Frames written per second of the last run', totals['frames_per_second'] or 0),
+            ('last_run_timestamp_seconds', 'Start time of the last run', report['started']),
+        )
+        lines = []
+        for name, description, value in metrics:
+            lines.append('# HELP {}_{} {}'.format(METRIC_PREFIX, name, description))
+            lines.append('# TYPE {}_{} gauge'.format(METRIC_PREFIX, name))
+            lines.append('{}_{}{{{}}} {}'.format(METRIC_PREFIX, name, labels, value))
+        write_atomic(path, '\n'.join(lines) + '\n')
+
+
+def write_atomic(path, text):
+    path = str(path)
+    try:
+        with open(path + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+    except OSError as err:
+        print(err)
+
+
+if __name__ == "__main__":
+    pass
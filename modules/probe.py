@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import sqlite3
+import threading
+import time
+import subprocess as sp
+from pathlib import Path
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+from modules.fileops import IO_WORKERS
+
+FFPROBE = 'ffprobe'
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'ffmpeg-wrapper'
+CACHE_FILE = 'probe.sqlite3'
+# Максимальное количество записей в кэше, при превышении вытесняются давно не использованные
+CACHE_MAX_ENTRIES = 100000
+# Меняется при изменении набора полей: кэш со старой схемой пересоздается
+SCHEMA_VERSION = 2
+PROBE_WORKERS = IO_WORKERS
+# Длительность начала видео (в секундах), по которому оценивается расстояние между ключевыми кадрами
+KEYFRAME_PROBE_DURATION = 60
+
+STREAM_ENTRIES = ('codec_name', 'codec_long_name', 'width', 'height', 'r_frame_rate', 'duration', 'nb_frames')
+FORMAT_ENTRIES = ('format_name', 'duration', 'size')
+
+
+def parse_value(value, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MediaInfo:
+    """Метаданные первого видеопотока и контейнера. keyframe_interval заполняется отдельным (ленивым) запросом."""
+
+    __slots__ = ('codec', 'codec_name', 'width', 'height', 'r_frame_rate', 'duration', 'nb_frames',
+                 'format_name', 'size', 'keyframe_interval')
+
+    def __init__(self, codec=None, codec_name=None, width=None, height=None, r_frame_rate=None, duration=None,
+                 nb_frames=None, format_name=None, size=None, keyframe_interval=None):
+        self.codec = None if codec is None else str(codec)
+        self.codec_name = None if codec_name is None else str(codec_name)
+        self.width = parse_value(width, int)
+        self.height = parse_value(height, int)
+        self.r_frame_rate = None if r_frame_rate is None else str(r_frame_rate)
+        self.duration = parse_value(duration, float)
+        self.nb_frames = parse_value(nb_frames, int)
+        self.format_name = None if format_name is None else str(format_name)
+        self.size = parse_value(size, int)
+        self.keyframe_interval = parse_value(keyframe_interval, float)
+
+    @property
+    def fps(self):
+        try:
+            return float(Fraction(self.r_frame_rate))
+        except (TypeError, ValueError, ZeroDivisionError):
+            return None
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, MediaInfo) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return 'MediaInfo({})'.format(', '.join('{}={!r}'.format(field, getattr(self, field))
+                                                for field in self.__slots__))
+
+    @classmethod
+    def from_json(cls, ffprobe_output):
+        """Разбирает вывод ffprobe -of json. Если у потока нет длительности (например, в avi),
+        берется длительность контейнера. Без видеопотока возвращает None.
+        """
+        data = json.loads(ffprobe_output)
+        streams = data.get('streams') or []
+        if not streams:
+            return None
+        stream, container = streams[0], data.get('format', {})
+        duration = stream.get('duration')
+        if parse_value(duration, float) is None:
+            duration = container.get('duration')
+        return cls(stream.get('codec_long_name'), stream.get('codec_name'), stream.get('width'),
+                   stream.get('height'), stream.get('r_frame_rate'), duration, stream.get('nb_frames'),
+                   container.get('format_name'), container.get('size'))
+
+
+class MetadataCache:
+    """Кэш результатов ffprobe в SQLite. Ключ записи - абсолютный путь, размер, mtime и inode файла:
+    если файл изменился, запись считается устаревшей и удаляется при следующем обращении.
+    """
+
+    COLUMNS = ', '.join('info_' + field for field in MediaInfo.__slots__)
+
+    def __init__(self, path=None, max_entries=CACHE_MAX_ENTRIES):
+        if path is None:
+            path = CACHE_DIR / CACHE_FILE
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.__max_entries = max_entries
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        with self.__connection:
+            if self.__connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                self.__connection.execute('DROP TABLE IF EXISTS media')
+                self.__connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS media ('
+                'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, {}, accessed REAL)'.format(
+                    self.COLUMNS)
+            )
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS media_accessed ON media (accessed)')
+
+    @staticmethod
+    def key(media):
+        media = Path(media).absolute()
+        stat = media.stat()
+        return str(media), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, media):
+        return self.get_many([media])[0]
+
+    def get_many(self, media_list):
+        """Записи для списка файлов одной транзакцией; для отсутствующих и устаревших - None."""
+        keys = [self.key(media) for media in media_list]
+        result = []
+        with self.__lock, self.__connection:
+            now = time.time()
+            for path, size, mtime_ns, inode in keys:
+                row = self.__connection.execute(
+                    'SELECT size, mtime_ns, inode, {} FROM media WHERE path = ?'.format(self.COLUMNS), (path, )
+                ).fetchone()
+                if row is not None and tuple(row[:3]) != (size, mtime_ns, inode):
+                    self.__connection.execute('DELETE FROM media WHERE path = ?', (path, ))
+                    row = None
+                if row is not None:
+                    self.__connection.execute('UPDATE media SET accessed = ? WHERE path = ?', (now, path))
+                result.append(None if row is None else MediaInfo(*row[3:]))
+        return result
+
+    def put(self, media, info):
+        self.put_many([(media, info)])
+
+    def put_many(self, items):
+        rows = [self.key(media) + tuple(info) + (time.time(), ) for media, info in items]
+        if not rows:
+            return
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                'INSERT OR REPLACE INTO media VALUES ({})'.format(', '.join('?' * len(rows[0]))), rows
+            )
+            self.__connection.execute(
+                'DELETE FROM media WHERE path IN (SELECT path FROM media ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.__max_entries, )
+            )
+
+    def invalidate(self, media):
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM media WHERE path = ?', (str(Path(media).absolute()), ))
+
+    def clear(self):
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM media')
+
+    def __len__(self):
+        with self.__lock:
+            return self.__connection.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Общий для процесса кэш. Если файл кэша недоступен, возвращает None и ffprobe запускается без кэша."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = MetadataCache()
+            except (OSError, sqlite3.Error) as err:
+                print('Metadata cache disabled: {}'.format(err))
+                _cache = False
+    return _cache if _cache is not False else None
+
+
+def run_ffprobe(media):
+    """Все нужные поля потока и контейнера за один вызов ffprobe."""
+    ffprobe_output = sp.check_output(
+        [
+            FFPROBE, '-v', '0', '-of', 'json', '-select_streams', 'v:0', '-show_entries',
+            'stream={}:format={}'.format(','.join(STREAM_ENTRIES), ','.join(FORMAT_ENTRIES)), str(media),
+        ]
+    )
+    return MediaInfo.from_json(ffprobe_output.decode('utf8'))
+
+
+def probe_uncached(media):
+    try:
+        info = run_ffprobe(media)
+    except (sp.CalledProcessError, UnicodeDecodeError, ValueError) as err:
+        print(err)
+        return None
+    if info is None:
+        print('No video stream: {}'.format(str(media)))
+    return info
+
+
+def probe_many(media_list, workers=PROBE_WORKERS, use_cache=True):
+    """Метаданные списка видеофайлов: словарь {путь: MediaInfo или None при ошибке} в порядке media_list.
+    Сначала одной транзакцией проверяется кэш, затем промахи опрашиваются ffprobe в пуле из workers потоков
+    и так же одной транзакцией записываются в кэш.
+    """
+    media_list = [Path(media) for media in media_list]
+    for media in media_list:
+        if not (media.exists() and media.is_file()):
+            raise FileNotFoundError(str(media))
+
+    cache = get_cache() if use_cache else None
+    result = dict.fromkeys(media_list)
+    if cache is not None:
+        try:
+            result.update(zip(media_list, cache.get_many(media_list)))
+        except sqlite3.Error as err:
+            print(err)
+
+    misses = [media for media, info in result.items() if info is None]
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(misses)))) as executor:
+            result.update(zip(misses, executor.map(probe_uncached, misses)))
+
+        if cache is not None:
+            try:
+                cache.put_many([(media, result[media]) for media in misses if result[media] is not None])
+            except sqlite3.Error as err:
+                print(err)
+    return result
+
+
+def probe(media, use_cache=True):
+    """Метаданные видеофайла из кэша или, при промахе, от ffprobe. Возвращает MediaInfo или None при ошибке."""
+    media = Path(media)
+    return probe_many([media], workers=1, use_cache=use_cache)[media]
+
+
+def get_keyframe_interval(media, info=None, use_cache=True):
+    """Среднее расстояние между ключевыми кадрами (в секундах) по первым KEYFRAME_PROBE_DURATION секундам.
+    Если в этом отрезке не больше одного ключевого кадра, возвращает KEYFRAME_PROBE_DURATION.
+    Требует чтения пакетов, поэтому запрашивается только при необходимости и сохраняется в кэше вместе с info.
+    """
+    if info is not None and info.keyframe_interval is not None:
+        return info.keyframe_interval
+    try:
+        ffprobe_output = sp.check_output(
+            [
+                FFPROBE, '-v', '0', '-of', 'csv=p=0', '-select_streams', 'v:0',
+                '-read_intervals', '%+{}'.format(KEYFRAME_PROBE_DURATION),
+                '-show_entries', 'packet=pts_time,flags', str(media),
+            ]
+        ).decode('utf8')
+    except (sp.CalledProcessError, UnicodeDecodeError) as err:
+        print(err)
+        return None
+
+    keyframes = []
+    for line in ffprobe_output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if flags.startswith('K') and parse_value(pts_time, float) is not None:
+            keyframes.append(float(pts_time))
+    if len(keyframes) < 2:
+        keyframe_interval = float(KEYFRAME_PROBE_DURATION)
+    else:
+        keyframe_interval = (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1)
+
+    if info is not None:
+        info.keyframe_interval = keyframe_interval
+        cache = get_cache() if use_cache else None
+        if cache is not None:
+            try:
+                cache.put(media, info)
+            except sqlite3.Error as err:
+                print(err)
+    return keyframe_interval
+
+
+def get_keyframes(media, timestamps):
+    """Время (в секундах) ближайшего ключевого кадра не позже каждой метки timestamps, без повторов и по возрастанию.
+    ffprobe перематывается к каждой метке и читает один пакет, поэтому длинное видео целиком не читается.
+    """
+    if not timestamps:
+        return []
+    try:
+        ffprobe_output = sp.check_output(
+            [
+                FFPROBE, '-v', '0', '-of', 'csv=p=0', '-select_streams', 'v:0',
+                '-read_intervals', ','.join('{:.6f}%+#1'.format(timestamp) for timestamp in timestamps),
+                '-show_entries', 'packet=pts_time,flags', str(media),
+            ]
+        ).decode('utf8')
+    except (sp.CalledProcessError, UnicodeDecodeError) as err:
+        print(err)
+        return []
+
+    keyframes = set()
+    for line in ffprobe_output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if flags.startswith('K') and parse_value(pts_time, float) is not None:
+            keyframes.add(float(pts_time))
+    return sorted(keyframes)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,195 @@
+import sys
+import json
+import time
+import threading
+import subprocess as sp
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+from modules.metrics import wait_process
+
+PROGRESS_MODES = ('off', 'text', 'json')
+# Минимальный интервал между событиями одной задачи (в секундах): текст читает человек, JSON - программа
+EMIT_PERIODS = {'text': 5.0, 'json': 1.0}
+
+
+def read_progress(stream):
+    """Разбирает вывод ffmpeg -progress: строки key=value, каждый блок заканчивается строкой
+    progress=continue (или progress=end в конце работы). yield возвращает блок словарем.
+    """
+    block = {}
+    for line in stream:
+        key, _, value = line.decode('utf8', 'replace').strip().partition('=')
+        if not key:
+            continue
+        block[key] = value
+        if key == 'progress':
+            yield block
+            block = {}
+
+
+def parse_number(value, kind=float):
+    """Число из значения ffmpeg ('N/A', '1.5x' и т.п.) или None."""
+    try:
+        return kind(str(value).rstrip('x'))
+    except (TypeError, ValueError):
+        return None
+
+
+def run_ffmpeg(cmd, callback=None, metrics=None):
+    """Выполняет команду ffmpeg как sp.run. С callback ffmpeg пишет -progress в канал, и callback вызывается
+    с каждым блоком (см. read_progress). В metrics (TaskMetrics) добавляется время и процессорное время процесса.
+    Возвращает sp.CompletedProcess.
+    """
+    if callback is not None:
+        # Блок -progress пишется раз в 0.5 с; -stats_period (ffmpeg 4.4+) не задается: частоту вывода событий
+        # ограничивает ProgressReporter
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    start = time.perf_counter()
+    process = sp.Popen(cmd, stdout=None if callback is None else sp.PIPE)
+    if callback is not None:
+        with process.stdout:
+            for block in read_progress(process.stdout):
+                callback(block)
+    returncode, rusage = wait_process(process)
+    if metrics is not None:
+        metrics.add_ffmpeg(time.perf_counter() - start, rusage)
+    return sp.CompletedProcess(cmd, returncode)
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ProgressReporter:
+    """Собирает прогресс процессов ffmpeg всех задач и выводит события: по задаче (кадров обработано, всего,
+    кадров в секунду, скорость относительно реального времени, оставшееся время) и по всем задачам вместе.
+    Задача может состоять из нескольких процессов (отрезки видео): их кадры и скорости складываются.
+    mode: text - строки для человека, json - одна строка JSON на событие, off - ничего не выводится.
+    Методы вызываются из потоков пула задач.
+    """
+
+    def __init__(self, mode='text', stream=None):
+        if mode not in PROGRESS_MODES:
+            raise ValueError('Unknown progress mode: {}'.format(mode))
+        self.__mode = mode
+        self.__stream = stream
+        self.__period = EMIT_PERIODS.get(mode, 0)
+        self.__lock = threading.Lock()
+        self.__tasks = {}
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    def start(self, key, name, parts):
+        """Регистрирует задачу key: parts - {процесс: количество кадров, которое он обработает (или None)}."""
+        with self.__lock:
+            now = time.monotonic()
+            task = self.__tasks.setdefault(key, {'name': name, 'parts': {}, 'state': 'running', 'emitted': 0,
+                                                 'started': now, 'finished': None})
+            for part, total in parts.items():
+                task['parts'][part] = {'total': total, 'frames': 0, 'fps': 0.0, 'speed': None, 'started': now,
+                                       'done': False}
+
+    def update(self, key, part, block):
+        """Блок -progress процесса part задачи key (кадры считаются по первому выходу команды ffmpeg)."""
+        with self.__lock:
+            task = self.__tasks.get(key)
+            if task is None or part not in task['parts']:
+                return
+            state = task['parts'][part]
+            frames = parse_number(block.get('frame'), int)
+            if frames is not None:
+                state['frames'] = frames
+            elapsed = time.monotonic() - state['started']
+            state['fps'] = state['frames'] / elapsed if elapsed > 0 else 0.0
+            state['speed'] = parse_number(block.get('speed'))
+            state['done'] = block.get('progress') == 'end'
+            if time.monotonic() - task['emitted'] < self.__period:
+                return
+            event = self.event(key)
+        self.emit(event)
+
+    def finish(self, key, status=0):
+        with self.__lock:
+            task = self.__tasks.get(key)
+            if task is None:
+                return
+            task['state'] = 'done' if status == 0 else 'failed'
+            task['finished'] = time.monotonic()
+            for state in task['parts'].values():
+                state['done'] = True
+            event = self.event(key)
+        self.emit(event)
+
+    def frames(self):
+        """Кадры, обработанные всеми задачами с начала работы."""
+        with self.__lock:
+            return sum(state['frames'] for task in self.__tasks.values() for state in task['parts'].values())
+
+    def task_progress(self, task):
+        """Прогресс задачи: у выполняемой задачи fps - текущая скорость ее процессов, у завершенной - средняя."""
+        parts = task['parts'].values()
+        frames = sum(state['frames'] for state in parts)
+        totals = [state['total'] for state in parts]
+        total = None if None in totals else sum(totals)
+        if task['finished'] is None:
+            fps = sum(state['fps'] for state in parts if not state['done'])
+        else:
+            fps = frames / max(task['finished'] - task['started'], 1e-9)
+        speeds = [state['speed'] for state in parts if not state['done'] and state['speed'] is not None]
+        eta = None
+        if task['state'] != 'running':
+            eta = 0
+        elif total is not None and fps > 0:
+            eta = max(0, total - frames) / fps
+        return {'frames': frames, 'total': total, 'fps': round(fps, 2),
+                'speed': round(sum(speeds), 2) if speeds else None, 'eta': None if eta is None else round(eta, 1)}
+
+    def event(self, key):
+        """Событие задачи key вместе с общим прогрессом. Вызывается под блокировкой."""
+        task = self.__tasks[key]
+        task['emitted'] = time.monotonic()
+        event = {'task': task['name'], 'state': task['state']}
+        event.update(self.task_progress(task))
+
+        tasks = [self.task_progress(item) for item in self.__tasks.values()]
+        frames = sum(item['frames'] for item in tasks)
+        total = sum(item['total'] for item in tasks if item['total'] is not None)
+        fps = sum(item['fps'] for item, state in zip(tasks, self.__tasks.values()) if state['state'] == 'running')
+        event['overall'] = {
+            'tasks': len(tasks),
+            'tasks_done': sum(1 for item in self.__tasks.values() if item['state'] != 'running'),
+            'frames': frames,
+            'total': total,
+            'fps': round(fps, 2),
+            'eta': round(max(0, total - frames) / fps, 1) if fps > 0 and total else None,
+        }
+        if event['overall']['tasks_done'] == len(tasks):
+            event['overall']['eta'] = 0
+        return event
+
+    def emit(self, event):
+        if self.__mode == 'off':
+            return
+        stream = self.__stream or sys.stdout
+        if self.__mode == 'json':
+            line = json.dumps(event)
+        else:
+            overall = event['overall']
+            line = '{}: {} {}/{} frames, {:.1f} fps, speed {}, ETA {} | all: {}/{} tasks, {:.1f} fps, ETA {}'.format(
+                event['task'], event['state'], event['frames'], '?' if event['total'] is None else event['total'],
+                event['fps'], '-' if event['speed'] is None else '{:.2f}x'.format(event['speed']),
+                format_eta(event['eta']), overall['tasks_done'], overall['tasks'], overall['fps'],
+                format_eta(overall['eta']))
+        print(line, file=stream, flush=True)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,236 @@
+import os
+import sys
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+# Как часто планировщик пересчитывает количество одновременных задач (в секундах). Между пересчетами должны
+# успеть завершиться несколько блоков -progress ffmpeg, иначе скорость мерится по шуму
+CONTROL_PERIOD = 10.0
+# Изменение скорости (доля) меньше этого считается шумом: лишняя задача не ускорила работу
+SPEED_TOLERANCE = 0.05
+# Доля времени процессора в ожидании ввода-вывода, выше которой диск считается узким местом
+IOWAIT_LIMIT = 0.25
+# Доля свободной памяти (MemAvailable от MemTotal), ниже которой задачи не добавляются, а убавляются
+MEMORY_RESERVE = 0.1
+# Свободное место на томе выходной директории (в байтах), при котором новые задачи не запускаются
+DISK_RESERVE = 1024 ** 3
+# Верхняя граница числа задач по умолчанию (на ядро): запись множества мелких файлов упирается в диск,
+# и пока один ffmpeg ждет запись, другой может декодировать
+MAX_JOBS_FACTOR = 2
+
+
+def read_meminfo(path='/proc/meminfo'):
+    """(MemAvailable, MemTotal) в байтах или None, если /proc недоступен (не Linux)."""
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('MemAvailable', 'MemTotal'):
+                    values[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    if len(values) != 2:
+        return None
+    return values['MemAvailable'], values['MemTotal']
+
+
+def read_cpu_times(path='/proc/stat'):
+    """(время всех состояний, время ожидания ввода-вывода) процессоров из строки cpu /proc/stat или None.
+    guest и guest_nice уже входят в user и nice, поэтому суммируются только первые 8 полей.
+    """
+    try:
+        with open(path) as f:
+            fields = f.readline().split()
+    except OSError:
+        return None
+    if len(fields) < 6 or fields[0] != 'cpu':
+        return None
+    times = [int(x) for x in fields[1:9]]
+    return sum(times), times[4]
+
+
+def get_free_space(path):
+    try:
+        return shutil.disk_usage(str(path)).free
+    except OSError:
+        return None
+
+
+def format_size(size):
+    return '{:.1f} GB'.format(size / 1024 ** 3)
+
+
+class ResourceMonitor:
+    """Снимки состояния системы для планировщика: свободная память, доля ожидания ввода-вывода с прошлого снимка
+    и свободное место на томах выходных директорий (том определяется по st_dev, проверяется один путь на том).
+    Без /proc (не Linux) память и ожидание ввода-вывода не измеряются (None).
+    """
+
+    def __init__(self):
+        self.__cpu_times = read_cpu_times()
+        self.__volumes = {}
+
+    def watch(self, directory):
+        """Добавляет том директории к проверке свободного места. Возвращает свободное место на нем."""
+        try:
+            device = os.stat(str(directory)).st_dev
+        except OSError:
+            return None
+        self.__volumes.setdefault(device, directory)
+        return get_free_space(self.__volumes[device])
+
+    def iowait(self):
+        times = read_cpu_times()
+        if times is None or self.__cpu_times is None:
+            return None
+        total, iowait = times[0] - self.__cpu_times[0], times[1] - self.__cpu_times[1]
+        self.__cpu_times = times
+        return iowait / total if total > 0 else None
+
+    def low_disk(self, reserve):
+        """Том, на котором свободно меньше reserve байт, и свободное место на нем, или None."""
+        for directory in self.__volumes.values():
+            free = get_free_space(directory)
+            if free is not None and free < reserve:
+                return directory, free
+        return None
+
+
+class AdaptiveScheduler:
+    """Выполняет задачи в пуле потоков, подбирая количество одновременных задач во время работы.
+    Каждые period секунд, если заняты все разрешенные места, сравнивает скорость (кадров в секунду по
+    progress) с прошлым периодом и сдвигает число задач на 1: пока скорость растет - в ту же сторону,
+    упала - в обратную, не изменилась - вниз (та же скорость меньшим числом задач). Нехватка памяти
+    и высокое ожидание ввода-вывода уменьшают число задач независимо от скорости, а нехватка места
+    на томе выходной директории приостанавливает запуск новых задач, пока место не освободится.
+    progress - ProgressReporter, через который ffmpeg задач сообщает обработанные кадры.
+    """
+
+    def __init__(self, progress, max_jobs, start_jobs=None, min_jobs=1, disk_reserve=DISK_RESERVE,
+                 period=CONTROL_PERIOD, monitor=None):
+        if not 1 <= min_jobs <= max_jobs:
+            raise ValueError('Jobs must satisfy 1 <= min_jobs <= max_jobs')
+        self.__progress = progress
+        self.__min_jobs = min_jobs
+        self.__max_jobs = max_jobs
+        self.__limit = max(min_jobs, min(max_jobs, start_jobs or max_jobs))
+        self.__disk_reserve = disk_reserve
+        self.__period = period
+        self.__monitor = monitor or ResourceMonitor()
+        self.__direction = 1
+        self.__speed = None
+        self.__frames = 0
+        self.__checked = time.monotonic()
+        self.__paused = None
+
+    @property
+    def limit(self):
+        return self.__limit
+
+    @property
+    def paused(self):
+        """Том с нехваткой места, из-за которого не запускаются новые задачи, или None."""
+        return self.__paused
+
+    def check_disk(self):
+        low = self.__monitor.low_disk(self.__disk_reserve)
+        if low is not None and self.__paused is None:
+            print('Scheduler: {} free on the volume of {}, pausing new tasks'.format(format_size(low[1]), low[0]))
+        elif low is None and self.__paused is not None:
+            print('Scheduler: free space recovered, resuming')
+        self.__paused = None if low is None else low[0]
+        return low is None
+
+    def adjust(self, running):
+        """Пересчитывает число задач по итогам периода. running - количество выполняемых задач."""
+        now = time.monotonic()
+        elapsed = now - self.__checked
+        frames = self.__progress.frames()
+        speed = (frames - self.__frames) / elapsed if elapsed > 0 else 0.0
+        self.__checked, self.__frames = now, frames
+        iowait = self.__monitor.iowait()
+        memory = read_meminfo()
+        self.check_disk()
+
+        reason = None
+        if memory is not None and memory[0] < memory[1] * MEMORY_RESERVE:
+            step, reason = -1, 'memory {} free'.format(format_size(memory[0]))
+        elif iowait is not None and iowait > IOWAIT_LIMIT:
+            step, reason = -1, 'iowait {:.0%}'.format(iowait)
+        elif running < self.__limit:
+            # Задач меньше, чем разрешено (очередь кончается или запуск приостановлен): скорость не показательна
+            self.__speed = None
+            return
+        elif self.__speed is None:
+            step = 0
+        elif speed < self.__speed * (1 - SPEED_TOLERANCE):
+            self.__direction = -self.__direction
+            step = self.__direction
+        elif speed <= self.__speed * (1 + SPEED_TOLERANCE):
+            self.__direction = -1
+            step = -1
+        else:
+            step = self.__direction
+        self.__speed = speed
+        if reason is not None:
+            self.__direction = -1
+            self.__speed = None
+
+        limit = max(self.__min_jobs, min(self.__max_jobs, self.__limit + step))
+        if limit != self.__limit:
+            print('Scheduler: jobs {} -> {} ({:.1f} fps{}{})'.format(
+                self.__limit, limit, speed,
+                '' if iowait is None else ', iowait {:.0%}'.format(iowait),
+                '' if reason is None else ', ' + reason))
+            self.__limit = limit
+
+    def run(self, tasks, run_task):
+        """Выполняет задачи функцией run_task (возвращает код завершения). Задачи берутся из итерируемого
+        объекта по мере освобождения мест. Возвращает список задач, завершившихся с ошибкой.
+        """
+        tasks = iter(tasks)
+        failed = []
+        waiting = None
+        exhausted = False
+        with ThreadPoolExecutor(max_workers=self.__max_jobs) as executor:
+            pending = {}
+            while True:
+                if time.monotonic() - self.__checked >= self.__period:
+                    self.adjust(len(pending))
+                while len(pending) < self.__limit and self.__paused is None:
+                    task = waiting
+                    if task is None:
+                        task = next(tasks, None) if not exhausted else None
+                        if task is None:
+                            exhausted = True
+                            break
+                        free = self.__monitor.watch(task.output_dir)
+                        if free is not None and free < self.__disk_reserve and not self.check_disk():
+                            waiting = task
+                            break
+                    waiting = None
+                    pending[executor.submit(run_task, task)] = task
+                if not pending:
+                    if exhausted and waiting is None:
+                        break
+                    # Запуск приостановлен, а выполняемых задач нет: ждем, пока освободится место
+                    time.sleep(self.__period)
+                    self.check_disk()
+                    continue
+                timeout = max(0.0, self.__period - (time.monotonic() - self.__checked))
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    if future.result() != 0:
+                        failed.append(task)
+        return failed
+
+
+if __name__ == "__main__":
+    pass
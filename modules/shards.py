@@ -0,0 +1,258 @@
+import os
+import sys
+import io
+import time
+import tarfile
+import threading
+from contextlib import contextmanager
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+# Куда пишутся кадры: files - файл на кадр, tar - шарды tar ограниченного размера (как в WebDataset),
+# pack - один файл с кадрами подряд на выходную директорию
+OUTPUT_BACKENDS = ('files', 'tar', 'pack')
+# Индекс архива: строка на кадр "номер<TAB>файл<TAB>смещение данных<TAB>размер". Смещения указывают на сами данные
+# кадра и в tar, и в pack, поэтому кадр читается по номеру без разбора tar
+INDEX_FILE = 'index.tsv'
+SHARD_NAME = 'shard-{:06d}.tar'
+PACK_NAME = 'frames.pack'
+# Размер шарда tar по умолчанию (в байтах)
+SHARD_SIZE = 512 * 1024 ** 2
+# Как часто упаковщик забирает в архив записанные ffmpeg кадры (в секундах)
+PACK_PERIOD = 1.0
+
+
+def read_index(directory):
+    """{номер кадра: (файл, смещение, размер)} из индекса архива в directory ({} - архива нет).
+    Кадр, упакованный повторно (после продолжения прерванного извлечения), берется из последней записи.
+    Строка, оборванная при аварийном завершении, пропускается.
+    """
+    frames = {}
+    try:
+        with open(os.path.join(str(directory), INDEX_FILE)) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 4 or not line.endswith('\n'):
+                    continue
+                frames[int(fields[0])] = (fields[1], int(fields[2]), int(fields[3]))
+    except (OSError, ValueError):
+        pass
+    return frames
+
+
+def archive_stats(directory):
+    """Количество и суммарный размер кадров в архиве directory."""
+    frames = read_index(directory)
+    return len(frames), sum(size for _, _, size in frames.values())
+
+
+def iter_frame_files(directory, ext):
+    """Записанные кадры в directory: (номер, путь) по возрастанию номера. ffmpeg пишет кадры атомарно
+    (-atomic_writing: во временный файл, затем переименование), поэтому файл с именем кадра записан полностью.
+    """
+    try:
+        with os.scandir(str(directory)) as entries:
+            frames = [(int(entry.name[:-len(ext) - 1]), entry.path) for entry in entries
+                      if entry.name.endswith('.' + ext) and entry.name[:-len(ext) - 1].isdigit()]
+    except OSError:
+        return []
+    return sorted(frames)
+
+
+class ShardWriter:
+    """Дописывает кадры в архив директории directory. Запуск продолжает существующий архив: tar - новым шардом
+    (дописывать в шард, оборванный при аварийном завершении, нельзя), pack - в конец файла.
+    Каждая пачка кадров сначала записывается и сбрасывается на диск в архив, затем в индекс.
+    """
+
+    def __init__(self, directory, ext, backend='tar', shard_size=SHARD_SIZE):
+        if backend not in OUTPUT_BACKENDS[1:]:
+            raise ValueError('Unknown archive backend: {}'.format(backend))
+        self.__directory = str(directory)
+        self.__ext = ext
+        self.__backend = backend
+        self.__shard_size = shard_size
+        shards = [name for name in os.listdir(self.__directory) if name.startswith('shard-') and name.endswith('.tar')]
+        self.__shard = len(shards)
+        self.__name = None
+        self.__file = None
+        self.__tar = None
+        self.__index = open(os.path.join(self.__directory, INDEX_FILE), 'a')
+
+    def open_shard(self):
+        if self.__backend == 'pack':
+            self.__name = PACK_NAME
+            self.__file = open(os.path.join(self.__directory, self.__name), 'ab')
+            return
+        self.__name = SHARD_NAME.format(self.__shard)
+        self.__shard += 1
+        self.__file = open(os.path.join(self.__directory, self.__name), 'wb')
+        self.__tar = tarfile.open(fileobj=self.__file, mode='w', format=tarfile.USTAR_FORMAT)
+
+    def close_shard(self):
+        if self.__tar is not None:
+            self.__tar.close()
+            self.__tar = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def write(self, number, data):
+        """Записывает кадр. Возвращает строку индекса."""
+        if self.__file is not None and self.__tar is not None and self.__file.tell() + len(data) > self.__shard_size:
+            self.close_shard()
+        if self.__file is None:
+            self.open_shard()
+        if self.__tar is None:
+            offset = self.__file.tell()
+            self.__file.write(data)
+        else:
+            info = tarfile.TarInfo('{:08d}.{}'.format(number, self.__ext))
+            info.size = len(data)
+            info.mtime = time.time()
+            # Короткое имя помещается в заголовок USTAR: данные начинаются сразу за одним блоком заголовка
+            offset = self.__file.tell() + tarfile.BLOCKSIZE
+            self.__tar.addfile(info, io.BytesIO(data))
+        return '{}\t{}\t{}\t{}\n'.format(number, self.__name, offset, len(data))
+
+    def add(self, frames):
+        """Упаковывает файлы кадров [(номер, путь)] и удаляет их. Возвращает количество упакованных кадров."""
+        lines, packed = [], []
+        for number, path in frames:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError as err:
+                print(err)
+                continue
+            lines.append(self.write(number, data))
+            packed.append(path)
+        if not packed:
+            return 0
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__index.writelines(lines)
+        self.__index.flush()
+        for path in packed:
+            os.remove(path)
+        return len(packed)
+
+    def close(self):
+        self.close_shard()
+        self.__index.close()
+
+
+class FramePacker:
+    """Пока ffmpeg пишет кадры в directory, фоновый поток каждые period секунд переносит записанные кадры
+    в архив (ShardWriter): одновременно на диске лежат только кадры последних секунд, а не все кадры видео.
+    close() упаковывает оставшиеся кадры и закрывает архив.
+    """
+
+    def __init__(self, directory, ext, backend='tar', shard_size=SHARD_SIZE, period=PACK_PERIOD):
+        self.__directory = directory
+        self.__ext = ext
+        self.__backend = backend
+        self.__shard_size = shard_size
+        self.__period = period
+        self.__writer = None
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    def pack(self):
+        frames = iter_frame_files(self.__directory, self.__ext)
+        if not frames:
+            return
+        if self.__writer is None:
+            self.__writer = ShardWriter(self.__directory, self.__ext, self.__backend, self.__shard_size)
+        self.__writer.add(frames)
+
+    def run(self):
+        while not self.__stop.wait(self.__period):
+            try:
+                self.pack()
+            except OSError as err:
+                print(err)
+
+    def close(self):
+        self.__stop.set()
+        self.__thread.join()
+        try:
+            self.pack()
+        finally:
+            if self.__writer is not None:
+                self.__writer.close()
+
+
+@contextmanager
+def packing(directories, ext, backend='tar', shard_size=SHARD_SIZE):
+    """Упаковывает кадры, которые пишутся в directories, пока выполняется блок with (files - не упаковывает)."""
+    packers = [] if backend == 'files' else [FramePacker(directory, ext, backend, shard_size)
+                                             for directory in directories]
+    try:
+        yield
+    finally:
+        for packer in packers:
+            try:
+                packer.close()
+            except OSError as err:
+                print(err)
+
+
+class FrameArchive:
+    """Чтение кадров архива выходной директории (tar или pack) по индексу:
+
+        archive = FrameArchive(task.output_path(name))
+        archive.numbers()      # номера кадров по возрастанию
+        archive.read(125)      # байты изображения кадра 125
+        for number, data in archive: ...
+    """
+
+    def __init__(self, directory):
+        self.__directory = str(directory)
+        self.__index = read_index(directory)
+        if not self.__index and not os.path.exists(os.path.join(self.__directory, INDEX_FILE)):
+            raise FileNotFoundError(os.path.join(self.__directory, INDEX_FILE))
+        self.__files = {}
+
+    def numbers(self):
+        return sorted(self.__index)
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, number):
+        return number in self.__index
+
+    def read(self, number):
+        name, offset, size = self.__index[number]
+        f = self.__files.get(name)
+        if f is None:
+            f = self.__files[name] = open(os.path.join(self.__directory, name), 'rb')
+        f.seek(offset)
+        data = f.read(size)
+        if len(data) != size:
+            raise OSError('Frame {} is truncated in {}'.format(number, name))
+        return data
+
+    def __iter__(self):
+        """(номер, байты) по возрастанию номера. Кадры одного шарда читаются подряд, если номера идут по порядку."""
+        for number in self.numbers():
+            yield number, self.read(number)
+
+    def close(self):
+        for f in self.__files.values():
+            f.close()
+        self.__files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    pass
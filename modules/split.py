@@ -1,19 +1,137 @@
+import os
 import sys
+import time
+import subprocess as sp
+from pathlib import Path
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 if sys.version_info[0] < 3:
     sys.stderr.write("You need Python 3 or later to run this script!\n")
     sys.exit(1)
 
+from modules.extract import walk_on_tree, get_jobs, thread_budget
+
+# Ширина номера фрагмента в имени файла
+CHUNK_NUMBER_WIDTH = 4
+# Кодирование при точной нарезке: ключевые кадры ставятся ровно на границах фрагментов
+EXACT_ENCODER = 'libx264'
+EXACT_PRESET = 'veryfast'
+EXACT_CRF = 18
+
+SplitReport = namedtuple('SplitReport', ('media', 'chunks', 'size', 'elapsed', 'returncode'))
+
 
 def add_subparser(module_name, subparsers):
     parser = subparsers.add_parser(module_name, help='Задачи разбиения видео на фрагменты')
     parser.set_defaults(command=module_name)
+    parser.add_argument('-d', '--duration', type=float, required=True, action='store',
+                        help='Длительность фрагмента (в секундах). Без --exact фрагмент заканчивается на первом '
+                             'ключевом кадре после этой длительности')
+    parser.add_argument('--exact', action='store_true',
+                        help='Перекодировать видео ({}) с ключевыми кадрами на границах: фрагменты ровно заданной '
+                             'длительности, но со скоростью кодека, а не диска'.format(EXACT_ENCODER))
+    parser.add_argument('--crf', type=int, default=EXACT_CRF, action='store', help='Качество кодирования для --exact')
+    parser.add_argument('--preset', type=str, default=EXACT_PRESET, action='store',
+                        help='Пресет кодирования для --exact')
+    parser.add_argument('-j', '--jobs', type=int, default=0, action='store',
+                        help='Количество одновременно разбиваемых видео (0 - по числу ядер)')
+    parser.add_argument('--include', type=str, nargs='+', default=[], metavar='PATTERN', action='store',
+                        help='Обрабатывать во входных директориях только файлы, подходящие под шаблон (fnmatch)')
+    parser.add_argument('--exclude', type=str, nargs='+', default=[], metavar='PATTERN', action='store',
+                        help='Пропускать файлы и директории, подходящие под шаблон')
+
+
+def split_command(media, output_dir, duration, exact=False, crf=EXACT_CRF, preset=EXACT_PRESET, threads=0):
+    """Команда ffmpeg для разбиения media на фрагменты muxer'ом segment. По умолчанию потоки копируются без
+    декодирования (-c copy), и граница фрагмента приходится на первый ключевой кадр после duration секунд.
+    exact - видео перекодируется с принудительными ключевыми кадрами через каждые duration секунд.
+    """
+    if exact:
+        codec = ['-c:v', EXACT_ENCODER, '-preset', preset, '-crf', str(crf), '-threads', str(threads),
+                 '-force_key_frames', 'expr:gte(t,n_forced*{})'.format(duration), '-c:a', 'copy']
+    else:
+        codec = ['-c', 'copy']
+    return [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-i', str(media),
+        '-map', '0:v', '-map', '0:a?', *codec,
+        '-f', 'segment', '-segment_time', str(duration), '-reset_timestamps', '1',
+        str(output_dir / '{}_%0{}d{}'.format(media.stem, CHUNK_NUMBER_WIDTH, media.suffix)),
+    ]
+
+
+def list_chunks(media, output_dir):
+    prefix = media.stem + '_'
+    with os.scandir(str(output_dir)) as entries:
+        return [entry for entry in entries if entry.name.startswith(prefix) and entry.name.endswith(media.suffix)
+                and entry.name[len(prefix):-len(media.suffix)].isdigit()]
+
+
+def split_media(media, output_dir, duration, exact=False, crf=EXACT_CRF, preset=EXACT_PRESET, threads=0):
+    """Разбивает media на фрагменты в директорию output_dir / <имя видео>. Возвращает SplitReport:
+    количество фрагментов, размер прочитанного видео (байт), время и код завершения ffmpeg.
+    """
+    output_dir = output_dir / media.stem
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # Фрагменты прошлого разбиения с другой длительностью иначе остались бы рядом с новыми
+    for entry in list_chunks(media, output_dir):
+        os.remove(entry.path)
+
+    start = time.perf_counter()
+    result = sp.run(split_command(media, output_dir, duration, exact, crf, preset, threads))
+    elapsed = time.perf_counter() - start
+    return SplitReport(media, len(list_chunks(media, output_dir)), media.stat().st_size, elapsed, result.returncode)
+
+
+def format_speed(size, elapsed):
+    return '{:.1f} MB/s'.format(size / max(elapsed, 1e-9) / 1e6)
 
 
 def main(parsed_args=None):
     if parsed_args is None:
         return
 
+    if not parsed_args['duration'] > 0:
+        print('Duration must be > 0')
+        return 1
+
+    output_directory = parsed_args.get('output_directory')
+    sources = list(walk_on_tree(map(Path, parsed_args['input']),
+                                Path(output_directory) if output_directory else None,
+                                parsed_args['recursive'],
+                                parsed_args.get('include'),
+                                parsed_args.get('exclude'),
+                                ))
+    if not sources:
+        print('No media to split')
+        return 1
+
+    jobs = get_jobs(parsed_args.get('jobs', 0), len(sources))
+    threads = thread_budget(jobs)
+
+    def run(source):
+        media, output_dir = source
+        report = split_media(media, output_dir, parsed_args['duration'], parsed_args.get('exact', False),
+                             parsed_args.get('crf', EXACT_CRF), parsed_args.get('preset', EXACT_PRESET), threads)
+        if report.returncode != 0:
+            print('ffmpeg exited with code {}: {}'.format(report.returncode, str(media)))
+        else:
+            print('{}: {} chunks, {:.1f} MB in {:.2f} s ({})'.format(str(media), report.chunks, report.size / 1e6,
+                                                                      report.elapsed,
+                                                                      format_speed(report.size, report.elapsed)))
+        return report
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        reports = list(executor.map(run, sources))
+    elapsed = time.perf_counter() - start
+
+    size = sum(report.size for report in reports)
+    print('Split {} of {} files, {:.1f} MB in {:.2f} s ({})'.format(
+        sum(1 for report in reports if report.returncode == 0), len(reports), size / 1e6, elapsed,
+        format_speed(size, elapsed)))
+    return 1 if any(report.returncode != 0 for report in reports) else 0
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,162 @@
+import os
+import math
+import sys
+import time
+from pathlib import Path
+from fractions import Fraction
+from collections import namedtuple
+
+if sys.version_info[0] < 3:
+    sys.stderr.write("You need Python 3 or later to run this script!\n")
+    sys.exit(1)
+
+from modules.fileops import IO_WORKERS, IO_BATCH_SIZE, native_sort, split_batches, apply_batch, run_batches
+
+FRAME_FORMAT = (".png", ".jpg", ".jpeg", ".bmp", ".ppm", ".webp", ".gif")
+THIN_WORKERS = IO_WORKERS
+DELETE_BATCH_SIZE = IO_BATCH_SIZE
+
+Plan = namedtuple('Plan', ('directory', 'keep', 'delete'))
+
+
+def add_subparser(module_name, subparsers):
+    parser = subparsers.add_parser(module_name, help='Прореживание директорий с кадрами')
+    parser.set_defaults(command=module_name)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-s', '--stride', type=int, action='store',
+                       help='Оставить каждый N-й кадр (первый кадр остается)')
+    group.add_argument('-k', '--keep_ratio', type=Fraction, action='store',
+                       help='Доля оставляемых кадров, например 2/3 - удалить каждый третий кадр')
+    group.add_argument('--delete_from', type=str, metavar='file', action='store',
+                       help="Удалить кадры из списка (путь в строке, '-' - стандартный ввод), например план, "
+                            "подтвержденный в GUI. Кадры вне входных директорий пропускаются")
+    parser.add_argument('-n', '--dry_run', action='store_true', help='Только показать план удаления')
+    parser.add_argument('-j', '--jobs', type=int, default=THIN_WORKERS, action='store',
+                        help='Количество потоков удаления')
+
+
+def collect_frames(path_list, recursive=False):
+    """Группирует кадры по директориям: {директория: [кадры]}. Для директорий из path_list берутся все кадры
+    (с recursive - и во вложенных директориях), для файлов - только переданные файлы.
+    """
+    frames = {}
+    for path in path_list:
+        if path.is_file():
+            if path.suffix.lower() in FRAME_FORMAT:
+                frames.setdefault(path.parent, set()).add(path)
+        elif path.is_dir():
+            for root, dirs, files in os.walk(str(path)):
+                frames.setdefault(Path(root), set()).update(
+                    Path(root) / name for name in files if os.path.splitext(name)[1].lower() in FRAME_FORMAT
+                )
+                if not recursive:
+                    break
+        else:
+            print('{} - not exists! Skip.'.format(str(path)))
+    return {directory: list(paths) for directory, paths in frames.items() if paths}
+
+
+def plan_thinning(frames, keep_ratio):
+    """Разбивает кадры одной директории на оставляемые и удаляемые. Кадры упорядочиваются native_sort, и доля
+    keep_ratio отсчитывается по позиции в этом порядке, поэтому пропуски в нумерации не сдвигают выборку.
+    Кадр i остается, если ceil((i+1)*keep_ratio) > ceil(i*keep_ratio): при keep_ratio = 1/N это каждый N-й кадр,
+    начиная с первого, при keep_ratio = (N-1)/N удаляется каждый N-й кадр.
+    """
+    keep_ratio = Fraction(keep_ratio)
+    if not 0 <= keep_ratio <= 1:
+        raise ValueError('Keep ratio must be in range 0-1')
+    keep, delete = [], []
+    for i, frame in enumerate(sorted(frames, key=native_sort)):
+        if math.ceil((i + 1) * keep_ratio) > math.ceil(i * keep_ratio):
+            keep.append(frame)
+        else:
+            delete.append(frame)
+    return keep, delete
+
+
+def make_plan(path_list, keep_ratio, recursive=False):
+    plan = []
+    for directory, frames in sorted(collect_frames(path_list, recursive).items(), key=lambda x: native_sort(x[0])):
+        keep, delete = plan_thinning(frames, keep_ratio)
+        plan.append(Plan(directory, keep, delete))
+    return plan
+
+
+def read_list(source):
+    """Пути из файла source (по одному в строке, '-' - стандартный ввод). Строки читаются байтами
+    и декодируются как имена файлов, поэтому список не зависит от локали процесса.
+    """
+    f = sys.stdin.buffer if source == '-' else open(source, 'rb')
+    try:
+        return [Path(os.fsdecode(line.rstrip(b'\r\n'))) for line in f if line.strip()]
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+def plan_from_list(paths, path_list):
+    """План удаления готового списка кадров (без прореживания). Удаляются только кадры внутри path_list."""
+    roots = [Path(os.path.abspath(str(path))) for path in path_list]
+    frames = {}
+    for path in paths:
+        path = Path(os.path.abspath(str(path)))
+        if path.suffix.lower() not in FRAME_FORMAT or not any(root == path or root in path.parents for root in roots):
+            print('{} - not an input frame! Skip.'.format(str(path)))
+            continue
+        frames.setdefault(path.parent, []).append(path)
+    return [Plan(directory, [], sorted(frames[directory], key=native_sort))
+            for directory in sorted(frames, key=native_sort)]
+
+
+def delete_batch(paths):
+    """Удаляет пачку файлов. Возвращает количество ошибок."""
+    return apply_batch(lambda path: os.remove(str(path)), paths)
+
+
+def run_plan(plan, workers=THIN_WORKERS, batch_size=DELETE_BATCH_SIZE):
+    paths = [path for item in plan for path in item.delete]
+    return run_batches(delete_batch, split_batches(paths, batch_size), workers)
+
+
+def main(parsed_args=None):
+    if parsed_args is None:
+        return
+
+    if parsed_args.get('delete_from') is not None:
+        keep_ratio = None
+    elif parsed_args.get('stride') is not None:
+        if parsed_args['stride'] < 1:
+            print('Stride must be >= 1')
+            return 1
+        keep_ratio = Fraction(1, parsed_args['stride'])
+    else:
+        keep_ratio = parsed_args['keep_ratio']
+
+    try:
+        if keep_ratio is None:
+            plan = plan_from_list(read_list(parsed_args['delete_from']), parsed_args['input'])
+        else:
+            plan = make_plan(map(Path, parsed_args['input']), keep_ratio, parsed_args['recursive'])
+    except (OSError, ValueError) as err:
+        print(err)
+        return 1
+
+    for item in plan:
+        print('{}: keep {}, delete {}'.format(str(item.directory), len(item.keep), len(item.delete)))
+    total = sum(len(item.keep) + len(item.delete) for item in plan)
+    deleted = sum(len(item.delete) for item in plan)
+    if parsed_args.get('dry_run'):
+        for item in plan:
+            for path in item.delete:
+                print('delete {}'.format(str(path)))
+        print('Dry run: {} of {} frames would be deleted'.format(deleted, total))
+        return 0
+
+    start = time.perf_counter()
+    errors = run_plan(plan, parsed_args.get('jobs') or THIN_WORKERS)
+    print('Deleted {} of {} frames in {:.2f} s'.format(deleted - errors, total, time.perf_counter() - start))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    pass
@@ -5,34 +5,84 @@ if sys.version_info[0] < 3:
     sys.exit(1)
 
 import argparse
+import json
+import os
 import re
 from pathlib import Path
-from natsort import natsorted
+from functools import lru_cache
+from natsort import natsort_keygen
+from modules.fileops import IO_WORKERS, IO_BATCH_SIZE, split_batches, apply_batch, run_batches
 
 time_pattern = re.compile(r"([01]?[0-9]|2[0-3])_([0-5][0-9])_([0-5][0-9])")
 sub_pattern = re.compile(r"(\s?\(\w+\))")
 
 IMAGE_FORMAT = ('.png', '.jpg')
+MOVE_WORKERS = IO_WORKERS
+MOVE_BATCH_SIZE = IO_BATCH_SIZE
+# Журнал запланированных перемещений: по нему прерванный запуск продолжается (или откатывается) без обхода дерева
+JOURNAL_FILE = '.rebase_journal.jsonl'
+# mtime директорий без поддиректорий после прошлого запуска: неизменившиеся директории повторно не читаются
+STATE_FILE = '.rebase_state.json'
+
+natsort_key = natsort_keygen()
 
 
 def abspath(path_string):
     return Path(path_string).absolute()
 
 
-def sorted_glob(pathlike_dir):
-    for ext in IMAGE_FORMAT:
-        yield from natsorted(pathlike_dir.glob('**/*' + ext))
+def iter_images(directory, watermarks=None, leaves=None):
+    """Обходит дерево одним проходом os.scandir и по мере обхода возвращает изображения
+    как пары (директория, имя файла) строками: на миллионах файлов pathlib заметно медленнее.
+    watermarks - {директория: mtime_ns} директорий без поддиректорий с прошлого запуска: если mtime не изменился,
+    содержимое директории то же самое, и она не читается. В leaves ({директория: mtime_ns}) добавляются все
+    директории без поддиректорий с mtime, прочитанным до os.scandir: изображение, записанное во время обхода,
+    меняет mtime после этого значения, и при следующем запуске директория будет прочитана снова.
+    """
+    watermarks = watermarks or {}
+    stack = [str(directory)]
+    while stack:
+        parent = stack.pop()
+        try:
+            mtime = os.stat(parent).st_mtime_ns
+            if watermarks.get(parent) == mtime:
+                if leaves is not None:
+                    leaves[parent] = mtime
+                continue
+            nested = False
+            with os.scandir(parent) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        nested = True
+                    elif entry.name.endswith(IMAGE_FORMAT):
+                        yield parent, entry.name
+            if leaves is not None and not nested:
+                leaves[parent] = mtime
+        except OSError as err:
+            print(err)
 
 
 def parse_ars():
     parser = argparse.ArgumentParser()
     parser.add_argument('directory', type=abspath, action='store', help="")
+    parser.add_argument('-j', '--jobs', type=int, default=MOVE_WORKERS, action='store',
+                        help="Количество потоков перемещения")
+    parser.add_argument('--rollback', action='store_true',
+                        help="Откатить перемещения прерванного запуска по журналу (по умолчанию они завершаются)")
+    parser.add_argument('--full', action='store_true',
+                        help="Прочитать все директории, не пропуская неизменившиеся с прошлого запуска")
     return vars(parser.parse_args())
 
 
-def get_name(image):
-    dirname = image.parent.name
-    pref = image.parent.parent.name.replace('_', '')
+@lru_cache(maxsize=None)
+def get_target(parent):
+    """Выходная директория и префикс имени для всех изображений директории parent (str).
+    Вычисляется один раз на директорию. Если имя директории не содержит время, возвращает None.
+    """
+    parent = Path(parent)
+    dirname = parent.name
+    pref = parent.parent.name.replace('_', '')
 
     if pref.startswith('20'):
         pref = pref[2:]
@@ -43,29 +93,185 @@ def get_name(image):
         if len(unbracket) == 6:
             pref = unbracket
 
+    match = re.match(time_pattern, dirname)
+    if match is None:
+        return None
+    hour = match.group(1)
+    output_dir = parent.parent / "{}_{}".format(pref, hour)
+    return str(output_dir), "{}_{}".format(pref, dirname.replace('_', ''))
+
+
+def get_filename(prefix, name):
+    stem, ext = os.path.splitext(name)
     try:
-        hour = re.match(time_pattern, dirname).group(1)
-    except AttributeError as err:
-        pass
+        frame_number = int(stem.rsplit('_', maxsplit=1)[-1])
+    except ValueError as err:
+        return "{}_{}".format(prefix, name)
     else:
+        return "{}_{:0=6}{}".format(prefix, frame_number, ext)
 
-        dirname = image.parent.name.replace('_', '')
 
-        output_dir = image.parent.parent / "{}_{}".format(pref, hour)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        ext = image.suffix
+def get_name(image):
+    target = get_target(str(image.parent))
+    if target is None:
+        return None
+    output_dir, prefix = target
+    return Path(output_dir) / get_filename(prefix, image.name)
 
-        try:
-            frame_number = int(image.stem.rsplit('_', maxsplit=1)[-1])
-        except ValueError as err:
-            filename = "{}_{}_{}".format(pref, dirname, image.name)
+
+@lru_cache(maxsize=None)
+def list_dir(directory):
+    """Имена файлов в выходной директории (один os.scandir на директорию); директория создается при отсутствии.
+    Возвращает множество имен и признак наличия поддиректорий.
+    """
+    os.makedirs(directory, exist_ok=True)
+    names, nested = set(), False
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            names.add(entry.name)
+            nested = nested or entry.is_dir(follow_symlinks=False)
+    return names, nested
+
+
+def plan_moves(directory, watermarks=None, leaves=None):
+    """Планирует все перемещения до их выполнения. Возвращает список (src, dst), список уже существующих
+    путей назначения, список пропущенных изображений и множество исходных директорий (все пути - строки).
+    Если в одно имя попадает несколько изображений, перемещается первое в порядке прежнего обхода
+    (png раньше jpg, внутри расширения - natsort), остальные считаются существующими.
+    """
+    # Кэши действуют в пределах одного планирования: между запусками дерево и выходные директории меняются
+    get_target.cache_clear()
+    list_dir.cache_clear()
+    planned = {}
+    exists = []
+    skipped = []
+    sub_dirs = set()
+    for parent, filename in iter_images(directory, watermarks, leaves):
+        sub_dirs.add(parent)
+        target = get_target(parent)
+        if target is None:
+            skipped.append(os.path.join(parent, filename))
+            continue
+        output_dir, prefix = target
+        name = (output_dir, get_filename(prefix, filename))
+        image = os.path.join(parent, filename)
+        previous = planned.get(name)
+        if previous is None:
+            planned[name] = image
+            continue
+        if move_order(image) < move_order(previous):
+            planned[name] = image
+        exists.append(os.path.join(*name))
+
+    moves = []
+    for (output_dir, filename), image in planned.items():
+        names, nested = list_dir(output_dir)
+        if leaves is not None and not nested:
+            # Выходная директория меняется перемещениями: ее mtime читается после них (в save_state). Изображения
+            # в ней не перемещаются (имя директории не содержит времени), поэтому запись во время запуска не теряется
+            leaves[output_dir] = None
+        if filename in names:
+            exists.append(os.path.join(output_dir, filename))
         else:
-            filename = "{}_{}_{:0=6}{}".format(pref, dirname, frame_number, ext)
+            moves.append((image, os.path.join(output_dir, filename)))
+    return moves, exists, skipped, sub_dirs
+
+
+def move_order(image):
+    return IMAGE_FORMAT.index(os.path.splitext(image)[1]), natsort_key(Path(image))
+
+
+def move_batch(moves):
+    """Перемещает пачку файлов. Возвращает количество ошибок."""
+    return apply_batch(lambda move: os.replace(*move), moves)
+
+
+def write_journal(batches, journal):
+    """Записывает весь план в журнал до первого перемещения; каждая пачка сразу сбрасывается на диск.
+    Пути записываются относительно директории журнала, чтобы дерево можно было перенести или смонтировать иначе.
+    Выходная директория лежит уровнем выше исходной и может оказаться вне директории журнала ('../...').
+    """
+    root = os.path.dirname(journal)
+    with open(journal, 'w') as f:
+        for batch in batches:
+            f.writelines(json.dumps([os.path.relpath(src, root), os.path.relpath(dst, root)]) + '\n'
+                         for src, dst in batch)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def load_journal(journal):
+    """Перемещения из журнала. Строка, запись которой прервалась, пропускается."""
+    root = os.path.dirname(journal)
+    moves = []
+    with open(journal) as f:
+        for line in f:
+            try:
+                src, dst = json.loads(line)
+            except ValueError:
+                continue
+            moves.append((os.path.normpath(os.path.join(root, src)), os.path.normpath(os.path.join(root, dst))))
+    return moves
+
 
-        return output_dir / filename
+def run_moves(moves, workers=MOVE_WORKERS, batch_size=MOVE_BATCH_SIZE, journal=None):
+    batches = split_batches(moves, batch_size)
+    if batches and journal is not None:
+        write_journal(batches, journal)
+    return run_batches(move_batch, batches, workers)
+
+
+def resume_moves(moves, workers=MOVE_WORKERS):
+    """Выполняет перемещения журнала, которые не успели выполниться."""
+    pending = [(src, dst) for src, dst in moves if os.path.exists(src) and not os.path.exists(dst)]
+    return len(pending), run_moves(pending, workers)
+
+
+def rollback_moves(moves, workers=MOVE_WORKERS):
+    """Возвращает файлы из журнала на исходные места; удаленные исходные директории создаются заново."""
+    pending = [(dst, src) for src, dst in moves if os.path.exists(dst) and not os.path.exists(src)]
+    for directory in set(os.path.dirname(src) for dst, src in pending):
+        os.makedirs(directory, exist_ok=True)
+    return len(pending), run_moves(pending, workers)
+
+
+def remove_dirs(directories):
+    for sd in directories:
+        try:
+            os.rmdir(sd)
+        except OSError as err:
+            print(err)
+
+
+def load_state(directory):
+    """mtime_ns директорий без поддиректорий после прошлого запуска (пути абсолютные)."""
+    try:
+        with open(os.path.join(str(directory), STATE_FILE)) as f:
+            watermarks = json.load(f)['watermarks']
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+    return {os.path.normpath(os.path.join(str(directory), path)): mtime for path, mtime in watermarks.items()}
+
+
+def save_state(directory, leaves):
+    """Сохраняет mtime_ns директорий без поддиректорий из leaves ({директория: mtime_ns}, None - прочитать сейчас)."""
+    watermarks = {}
+    for leaf, mtime in leaves.items():
+        try:
+            watermarks[os.path.relpath(leaf, str(directory))] = os.stat(leaf).st_mtime_ns if mtime is None else mtime
+        except OSError:
+            continue
+    path = os.path.join(str(directory), STATE_FILE)
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'watermarks': watermarks}, f)
+        os.replace(path + '.tmp', path)
+    except OSError as err:
+        print(err)
 
 
 def main():
+    """Возвращает количество перемещений, завершившихся ошибкой."""
     args = parse_ars()
 
     directory = args['directory']
@@ -73,25 +279,43 @@ def main():
     if not directory.is_dir():
         raise NotADirectoryError(str(directory.resolve()))
 
-    sub_dirs = set()
-
-    for image in sorted_glob(directory):
-        sub_dirs.add(image.parent)
-        name = get_name(image)
-        if name is not None:
-            if name.exists():
-                print(name + " : Exists!")
-            else:
-                image.replace(name)
+    journal = os.path.join(str(directory), JOURNAL_FILE)
+    if os.path.exists(journal):
+        # Прошлый запуск прерван: его перемещения завершаются или откатываются по журналу, без обхода дерева
+        moves = load_journal(journal)
+        if args['rollback']:
+            count, errors = rollback_moves(moves, args['jobs'])
+            remove_dirs(set(os.path.dirname(dst) for src, dst in moves))
+            print("Rolled back {} of {} moves".format(count - errors, len(moves)))
         else:
-            print("{} - skipped!".format(image))
+            count, errors = resume_moves(moves, args['jobs'])
+            remove_dirs(set(os.path.dirname(src) for src, dst in moves))
+            print("Resumed {} of {} moves".format(count - errors, len(moves)))
+        if not errors:
+            os.remove(journal)
+        return errors
+    if args['rollback']:
+        print("No journal in {}: nothing to roll back".format(str(directory)))
+        return 0
 
-    for sd in sub_dirs:
-        try:
-            sd.rmdir()
-        except OSError as err:
-            print(err)
+    leaves = {}
+    moves, exists, skipped, sub_dirs = plan_moves(directory, None if args['full'] else load_state(directory), leaves)
+    # mtime исходных директорий меняется перемещениями: при следующем запуске они читаются снова
+    for src, dst in moves:
+        leaves.pop(os.path.dirname(src), None)
+    for name in exists:
+        print("{} : Exists!".format(name))
+    for image in skipped:
+        print("{} - skipped!".format(image))
+
+    errors = run_moves(moves, args['jobs'], journal=journal)
+
+    remove_dirs(sub_dirs)
+    save_state(directory, leaves)
+    if not errors and os.path.exists(journal):
+        os.remove(journal)
+    return errors
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(1 if main() else 0)
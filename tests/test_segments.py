@@ -0,0 +1,118 @@
+import os
+import sys
+import shutil
+import filecmp
+import tempfile
+import unittest
+import subprocess as sp
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.extract import ExtractionTask, extract_by_frame_interval, extract_by_time_interval, run_task, \
+    frame_interval_first, seek_position, segment_starts, time_interval_indices, time_interval_mark, time_interval_step
+
+SEGMENTS = 3
+
+
+def make_clip(path, size, duration, fps, gop):
+    sp.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-f', 'lavfi',
+            '-i', 'testsrc2=size={}:rate={}:duration={}'.format(size, fps, duration),
+            '-c:v', 'libx264', '-g', str(gop), '-pix_fmt', 'yuv420p', str(path)], check=True)
+
+
+def extract(clip, root_dir, segments, frame_intervals, time_intervals):
+    task = ExtractionTask(clip, root_dir, segments=segments)
+    for frame_interval in frame_intervals:
+        extract_by_frame_interval(task, frame_interval)
+    for time_interval in time_intervals:
+        extract_by_time_interval(task, time_interval)
+    if run_task(task) != 0:
+        raise RuntimeError('Extraction failed: {} segments'.format(segments))
+    return task
+
+
+def compare(expected, actual):
+    """Количество кадров и список отличий: отсутствующие, лишние и отличающиеся по содержимому файлы."""
+    names = sorted(name for name in os.listdir(str(expected)) if not name.startswith('.'))
+    extra = sorted(name for name in set(os.listdir(str(actual))) - set(names) if not name.startswith('.'))
+    _, mismatch, errors = filecmp.cmpfiles(str(expected), str(actual), names, shallow=False)
+    return len(names), ['missing {}'.format(x) for x in errors] + ['extra {}'.format(x) for x in extra] + \
+        ['differs {}'.format(x) for x in mismatch]
+
+
+class SegmentArithmeticTest(unittest.TestCase):
+    """Границы отрезков и смещение start без ffmpeg: кадры и имена отрезков в сумме дают кадры одного процесса."""
+
+    def test_segment_starts(self):
+        self.assertEqual(segment_starts([0.0, 4.0, 4.0, 8.04], 25.0), [100, 201])
+        self.assertEqual(segment_starts([0.0], 25.0), [])
+        self.assertEqual(segment_starts([3600.0], 30000 / 1001), [107892])
+
+    def test_seek_position(self):
+        for fps in (25.0, 30000 / 1001, 12800 / 511):
+            for frame in (1, 2, 1799, 107892, 12 * 3600 * 30):
+                position = float(seek_position(frame / fps, fps))
+                self.assertTrue((frame - 1) / fps < position < frame / fps, (fps, frame))
+        self.assertEqual(seek_position(0.0, 25.0), '0.000000')
+
+    def test_frame_interval_segments(self):
+        total = 500
+        for frame_interval in (1, 7, 50):
+            expected = [n + 1 for n in range(0, total, frame_interval)]
+            for bounds in ([0, total], [0, 100, 201, total], [0, 1, 7, 8, 499, total]):
+                names = []
+                for start, end in zip(bounds, bounds[1:]):
+                    first = frame_interval_first(frame_interval, start)
+                    names.extend(n + 1 for n in range(first, end, frame_interval))
+                self.assertEqual(names, expected, (frame_interval, bounds))
+
+    def test_time_interval_segments(self):
+        total = 1000
+        for fps, time_interval in ((25.0, 1300), (25.0, 10), (30000 / 1001, 7000)):
+            step = time_interval_step(fps, time_interval)
+            expected = []
+            for k, n in time_interval_indices(fps, time_interval):
+                if n >= total:
+                    break
+                expected.append(k * time_interval)
+            for bounds in ([0, total], [0, 100, 201, total], [0, 1, 33, 34, 999, total]):
+                # Отрезок отбирает кадры start..end-1 по номеру кадра в видео (n + start), как time_interval_filter
+                names = [time_interval_mark(step, n) * time_interval for start, end in zip(bounds, bounds[1:])
+                         for n in range(start, end) if n // step > (n - 1) // step]
+                self.assertEqual(names, expected, (fps, time_interval, bounds))
+
+
+@unittest.skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), 'ffmpeg and ffprobe are required')
+class SegmentsTest(unittest.TestCase):
+    """Извлечение по отрезкам (--segments) должно давать те же кадры, что и извлечение одним процессом."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.clip = Path(cls.tmp.name) / 'clip.mp4'
+        make_clip(cls.clip, '160x90', 12, 25, 50)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def check(self, name, frame_intervals, time_intervals):
+        root = Path(self.tmp.name) / name
+        single = extract(self.clip, root / 'single', 1, frame_intervals, time_intervals)
+        split = extract(self.clip, root / 'split', SEGMENTS, frame_intervals, time_intervals)
+        self.assertIsNotNone(split.segment_bounds())
+        for output in single.outputs:
+            count, differences = compare(single.output_path(output.name), split.output_path(output.name))
+            self.assertGreater(count, 0, output.name)
+            self.assertEqual(differences, [], output.name)
+
+    def test_frame_interval(self):
+        self.check('frame', [1, 7], [])
+
+    def test_time_interval(self):
+        self.check('time', [], [1300])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import sys
+import itertools
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.extract import time_interval_indices, time_interval_mark, time_interval_step
+
+
+def marks(fps, time_interval, duration):
+    return list(itertools.takewhile(lambda x: x[0] * time_interval < duration * 1000,
+                                    time_interval_indices(fps, time_interval)))
+
+
+class TimeIntervalTest(unittest.TestCase):
+    """Метки time_interval: первый кадр не раньше каждой метки, без накопления погрешности float fps."""
+
+    def test_ntsc_long_recording(self):
+        targets = marks(30000 / 1001, 60000, 10 * 3600)
+        self.assertEqual(len(targets), 600)
+        self.assertEqual(targets[1], (1, 1799))
+
+    def test_no_exact_multiple(self):
+        self.assertEqual(len(marks(12800 / 511, 60000, 3600)), 60)
+
+    def test_frame_follows_mark(self):
+        for k, n in marks(25.0, 1300, 600):
+            self.assertTrue(k * 1300 <= n * 40 < k * 1300 + 40, (k, n))
+
+    def test_mark_of_selected_frame(self):
+        for fps, time_interval in ((25.0, 1300), (25.0, 10), (30000 / 1001, 7000)):
+            step = time_interval_step(fps, time_interval)
+            for k, n in marks(fps, time_interval, 60):
+                self.assertEqual(time_interval_mark(step, n), k)
+
+
+if __name__ == "__main__":
+    unittest.main()
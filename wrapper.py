@@ -1,42 +1,148 @@
 import os
 import sys
+import json
 import argparse
+import ast
 import pkgutil
-import inspect
+import importlib.util
 
 if sys.version_info[0] < 3:
     sys.stderr.write("You need Python 3 or later to run this script!\n")
     sys.exit(1)
 
 DEFAULT_MODULES_DIRNAME = "modules"
+# Директории рядом с wrapper.py, в которых нет подкоманд: скрипты замеров импортировать при построении манифеста нельзя
+EXCLUDED_DIRNAMES = ('benchmarks', 'tests', 'images')
+MANIFEST_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                             'ffmpeg-wrapper', 'plugins.json')
+
+
+class SubparsersRecorder:
+    """Подменяет subparsers при построении манифеста: запоминает имя и справку подкоманды,
+    а аргументы модуль добавляет во временный парсер, который затем отбрасывается.
+    """
+
+    def __init__(self):
+        self.commands = {}
+
+    def add_parser(self, name, **kwargs):
+        self.commands[name] = kwargs.get('help', '')
+        return argparse.ArgumentParser(prog=name, add_help=False)
+
+
+class TrialArgumentParser(argparse.ArgumentParser):
+    """Пробный разбор: при ошибке бросает ArgumentError вместо вывода справки и завершения программы."""
+
+    def error(self, message):
+        raise argparse.ArgumentError(None, message)
 
 
 # modules_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'modules')
-def get_modules(subparsers):
-    modules = {}
+def iter_plugins():
+    """Модули в поддиректориях рядом с wrapper.py, кроме EXCLUDED_DIRNAMES (без импорта):
+    (имя подкоманды, имя модуля, путь).
+    """
     modules_root = os.path.dirname(os.path.realpath(__file__))
     for sub_dir in (x for x in os.listdir(modules_root) if os.path.isdir(os.path.join(modules_root, x))):
 
-        if not sub_dir.startswith(('.', '__')):
+        if not sub_dir.startswith(('.', '__')) and sub_dir not in EXCLUDED_DIRNAMES:
 
             for module_finder, name, ispkg in pkgutil.iter_modules(path=[os.path.join(modules_root, sub_dir), ]):
+                if ispkg:
+                    continue
+                path = os.path.join(modules_root, sub_dir, name + '.py')
+                command = name if sub_dir == DEFAULT_MODULES_DIRNAME else '{}/{}'.format(sub_dir, name)
+                yield command, name, path
+
+
+def get_stamps():
+    """mtime директорий и файлов модулей: при любом изменении манифест перестраивается."""
+    modules_root = os.path.dirname(os.path.realpath(__file__))
+    stamps = {modules_root: os.stat(modules_root).st_mtime_ns}
+    for command, name, path in iter_plugins():
+        stamps.setdefault(os.path.dirname(path), os.stat(os.path.dirname(path)).st_mtime_ns)
+        stamps[path] = os.stat(path).st_mtime_ns
+    return stamps
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
-                module = module_finder.find_module(name).load_module(name)
 
-                if sub_dir != DEFAULT_MODULES_DIRNAME:
-                    name = '{}/{}'.format(sub_dir, name)
-                modules[name] = module
+def defines_subparser(path):
+    """Объявлена ли в модуле функция add_subparser (по исходному тексту, без импорта):
+    вспомогательные модули (probe, metrics и т.п.) не являются подкомандами и не импортируются.
+    """
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+    except (OSError, SyntaxError, ValueError) as err:
+        print('Plugin {} skipped: {}'.format(path, err))
+        return False
+    return any(isinstance(node, ast.FunctionDef) and node.name == 'add_subparser' for node in tree.body)
+
+
+def build_manifest(stamps):
+    """Импортирует модули подкоманд один раз и записывает подкоманды в манифест."""
+    commands = {}
+    for command, name, path in iter_plugins():
+        if not defines_subparser(path):
+            continue
+        module = load_module(name, path)
+        add_subparser = getattr(module, 'add_subparser', None)
+        if callable(add_subparser):
+            recorder = SubparsersRecorder()
+            add_subparser(command, recorder)
+            commands[command] = {'module': name, 'path': path, 'help': recorder.commands.get(command, '')}
+
+    manifest = {'stamps': stamps, 'commands': commands}
+    try:
+        os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+        with open(MANIFEST_PATH + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(MANIFEST_PATH + '.tmp', MANIFEST_PATH)
+    except OSError as err:
+        print('Plugin manifest not saved: {}'.format(err))
+    return manifest
+
 
-                for function_name, function in inspect.getmembers(module, inspect.isfunction):
-                    if function_name == 'add_subparser':
-                        function(name, subparsers)
+def get_manifest():
+    stamps = get_stamps()
+    try:
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = None
+    if manifest is None or manifest.get('stamps') != stamps:
+        manifest = build_manifest(stamps)
+    return manifest
+
+
+def get_modules(subparsers, manifest, selected=()):
+    """Регистрирует подкоманды из манифеста. Импортируются только модули выбранных подкоманд,
+    остальные подкоманды добавляются только со справкой.
+    """
+    modules = {}
+    for command, entry in manifest['commands'].items():
+        if command in selected:
+            module = load_module(entry['module'], entry['path'])
+            module.add_subparser(command, subparsers)
+            modules[command] = module
+        else:
+            subparsers.add_parser(command, help=entry['help'], add_help=False).set_defaults(command=command)
     return modules
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Modular FFMPEG Wrapper')
-    subparsers = parser.add_subparsers(help='Available modules')
-    subparsers.required = True
+def build_parser(parser_class=argparse.ArgumentParser, with_subparsers=True):
+    parser = parser_class(description='Modular FFMPEG Wrapper')
+    subparsers = None
+    if with_subparsers:
+        subparsers = parser.add_subparsers(help='Available modules')
+        subparsers.required = True
 
     parser.add_argument('-i', '--input', type=os.path.abspath, nargs='+', metavar='file/directory',
                         required=True, action='store', help='Input data (files or folders separated by a space)')
@@ -44,10 +150,31 @@ def main():
                         action='store', help='Root directory for processed data')
     parser.add_argument('-r', '--recursive', action='store_true', help='Recursive processing of input directories')
     parser.add_argument('--debug', action='store_true', help='Debug mode')
+    return parser, subparsers
 
-    modules = get_modules(subparsers)
 
-    args = parser.parse_args(['--help', ] if len(sys.argv) == 1 else None)
+def main():
+    argv = ['--help', ] if len(sys.argv) == 1 else sys.argv[1:]
+    manifest = get_manifest()
+
+    # Общие аргументы и аргументы подкоманды разбираются раздельно: при общем разборе -i (nargs='+') забирает
+    # имя подкоманды вместе с входными файлами, если между ними нет другого ключа. Подкомандой считается первый
+    # совпадающий аргумент, перед которым общие аргументы разбираются без ошибок (иначе это значение аргумента).
+    for index, command in ((i, arg) for i, arg in enumerate(argv) if arg in manifest['commands']):
+        try:
+            args = build_parser(TrialArgumentParser, with_subparsers=False)[0].parse_args(argv[:index])
+        except argparse.ArgumentError:
+            continue
+        parser, subparsers = build_parser()
+        modules = get_modules(subparsers, manifest, {command})
+        vars(args).update(vars(subparsers.choices[command].parse_args(argv[index + 1:])))
+        break
+    else:
+        # Подкоманда не указана: argparse выводит справку или ошибку по полной строке аргументов
+        parser, subparsers = build_parser()
+        get_modules(subparsers, manifest)
+        parser.parse_args(argv)
+        sys.exit(2)
 
     if args.debug:
         print(args)
@@ -55,10 +182,11 @@ def main():
         sys.exit(0)
 
     try:
-        modules[args.command].main(vars(args))
+        status = modules[args.command].main(vars(args))
     except (AttributeError, KeyError):
         print('Call module "{}" error.'.format(args.command))
         sys.exit(1)
+    sys.exit(status)
 
 
 if __name__ == "__main__":
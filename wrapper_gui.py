@@ -4,13 +4,18 @@ if sys.version_info[0] < 3:
     sys.stderr.write("You need Python 3 or later to run this script!\n")
     sys.exit(1)
 
-import subprocess as sp
+import os
+import json
+import threading
 from PIL import Image
 from pathlib import Path
 from PyQt5 import QtCore, QtWidgets, QtGui
 from functools import partial
 from natsort import natsorted
 from collections import namedtuple
+from modules.probe import probe, PROBE_WORKERS
+from modules.thin import make_plan
+from modules.progress import format_eta
 
 VideoInfo = namedtuple('VideoInfo', ('STATUS', 'CODEC', 'WIDTH', 'HEIGHT', 'FPS', 'DURATION', 'FRAMES_QUANTITY'))
 ImageInfo = namedtuple('ImageInfo', ('STATUS', 'TYPE', "MODE", 'WIDTH', 'HEIGHT'))
@@ -26,37 +31,21 @@ def deleteItemsOfLayout(layout):
         widget = item.widget()
         widget.setParent(None)
 
-def get_video_info(video_file):
-    # Соблюдать этот порядок полей при обработки вывода ffprobe
-    fields = (
-        'codec_long_name',
-        'width',
-        'height',
-        'r_frame_rate',
-        'duration',
-        'nb_frames',
-    )
-
-    sep = ','
+def get_video_info(video_file, info=None):
+    # Метаданные берутся из общего с wrapper.py кэша, ffprobe запускается только для новых или измененных файлов
     on_error = VideoInfo(False, 'Unknown', 0, 0, 0.0, 0.0, 0)
-    # on_error = 'Unknown', 0, 0, 0.0, 0.0, 0
-
-    ff_cmd = [str(FFPROBE), '-v', '0', '-of', 'csv=p=0', '-select_streams', 'v:0',
-              '-show_entries', 'stream={}'.format(sep.join(fields)), str(Path(video_file))]
-
-    try:
-        return VideoInfo(
-            True,
-            *(action(item) for item, action in zip(
-                sp.check_output(ff_cmd).decode(sys.stdout.encoding).rstrip('\n').split(sep),
-                (str, int, int, eval, float, int)
-            ))
-        )
-    except (sp.CalledProcessError, AttributeError, ValueError, TypeError) as e:
+
+    if info is None:
+        try:
+            info = probe(Path(video_file))
+        except FileNotFoundError as os_err:
+            print(os_err)
+            sys.exit(1)
+
+    if info is None or info.fps is None:
         return on_error
-    except FileNotFoundError as os_err:
-        print(os_err)
-        sys.exit(1)
+    return VideoInfo(True, info.codec, info.width, info.height, info.fps,
+                     info.duration or 0.0, info.nb_frames or 0)
 
 def get_image_info(image_file):
     image = Image.open(image_file)
@@ -65,7 +54,7 @@ def get_image_info(image_file):
 
 class BlockWindow(QtWidgets.QWidget):
 
-    def __init__(self, message="", parent=None):
+    def __init__(self, message="", parent=None, progress=False):
         super().__init__()
         self.setWindowTitle('Обработка')
         self.setWindowModality(QtCore.Qt.ApplicationModal)
@@ -77,6 +66,59 @@ class BlockWindow(QtWidgets.QWidget):
 
         vbox.addWidget(QtWidgets.QLabel(message))
 
+        # Прогресс в промилле: точности процента мало для многочасовых пакетов
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setFormat('%p%')
+        self.progress_label = QtWidgets.QLabel()
+        self.tasks_count = 0
+        if progress:
+            vbox.addWidget(self.progress_bar)
+            vbox.addWidget(self.progress_label)
+            self.resize(500, 100)
+
+    def set_progress(self, event):
+        """Показывает событие прогресса (см. modules/progress.py): общий прогресс и состояние текущей задачи."""
+        overall = event['overall']
+        if overall['total']:
+            # Задачи запускаются по мере обхода входных файлов: еще не начатые задачи в событии не учтены
+            done = overall['frames'] / overall['total'] * overall['tasks'] / max(self.tasks_count, overall['tasks'])
+            self.progress_bar.setValue(min(1000, int(done * 1000)))
+        self.progress_label.setText(
+            'Задач завершено: {} из {}, {:.0f} кадр/с, осталось {}\n{}: {:.0f} кадр/с, осталось {}'.format(
+                overall['tasks_done'], overall['tasks'], overall['fps'], format_eta(overall['eta']),
+                Path(event['task']).name, event['fps'], format_eta(event['eta'])))
+
+    def reset_progress(self, tasks_count=0):
+        self.tasks_count = tasks_count
+        self.progress_bar.setValue(0)
+        self.progress_label.setText('')
+
+
+class ProbeSignals(QtCore.QObject):
+    # path, MediaInfo (или None), поколение загрузки
+    probed = QtCore.pyqtSignal(object, object, int)
+
+
+class ProbeWorker(QtCore.QRunnable):
+    """Опрос одного видеофайла в пуле потоков. Результат доставляется в главный поток сигналом probed."""
+
+    def __init__(self, path, generation, signals, cancelled):
+        super().__init__()
+        self.path = path
+        self.generation = generation
+        self.signals = signals
+        self.cancelled = cancelled
+
+    def run(self):
+        info = None
+        if not self.cancelled.is_set():
+            try:
+                info = probe(self.path)
+            except FileNotFoundError as os_err:
+                print(os_err)
+        self.signals.probed.emit(self.path, info, self.generation)
+
 
 class TableView(QtWidgets.QTableView):
 
@@ -97,10 +139,10 @@ class TableView(QtWidgets.QTableView):
         self.table_sti = QtGui.QStandardItemModel()
         self.setModel(self.table_sti)
 
-    def append_to_table(self, path):
+    def append_to_table(self, path, info=None):
         self.table_sti.setHorizontalHeaderLabels(self.names_sti)
         if self.mode == 1:
-            video_info = get_video_info(path)
+            video_info = get_video_info(path, info)
             if video_info.STATUS:
                 pathItem = QtGui.QStandardItem()
                 pathItem.setData(str(path))
@@ -157,8 +199,8 @@ class Window(QtWidgets.QWidget):
         load_frames_btn = QtWidgets.QPushButton("Добавить кадры")
         load_frames_btn.clicked.connect(self.on_load_frames)
 
-        execute_frames_btn = QtWidgets.QPushButton("Извлечь кадры")
-        execute_frames_btn.clicked.connect(self.on_load_frames)
+        execute_frames_btn = QtWidgets.QPushButton("Удалить кадры")
+        execute_frames_btn.clicked.connect(self.on_thin_frames)
 
         self.mode_combo = QtWidgets.QComboBox()
         self.mode_combo.activated.connect(self.on_change_combobox)
@@ -171,11 +213,21 @@ class Window(QtWidgets.QWidget):
 
         self.frames_field = QtWidgets.QSpinBox()
         self.frames_field.setAlignment(QtCore.Qt.AlignRight)
-        self.frames_field.setRange(1, 10**6)
+        self.frames_field.setRange(2, 10**6)
+
+        self.probe_progress = QtWidgets.QProgressBar()
+        self.probe_progress.setFormat('Чтение видеофайлов: %v из %m')
+        self.probe_progress.hide()
+
+        self.cancel_probe_btn = QtWidgets.QPushButton('Отменить')
+        self.cancel_probe_btn.clicked.connect(self.on_cancel_probe)
+        self.cancel_probe_btn.hide()
 
         buttonbox.addWidget(clear_table_btn)
         buttonbox.addWidget(grouping_btn)
         buttonbox.addStretch(0)
+        buttonbox.addWidget(self.probe_progress)
+        buttonbox.addWidget(self.cancel_probe_btn)
         self.buttonbox_media.addWidget(QtWidgets.QLabel('Работа с видеофайлами  '))
         self.buttonbox_media.addWidget(load_media_btn)
         self.buttonbox_media.addWidget(execute_media_btn)
@@ -193,6 +245,10 @@ class Window(QtWidgets.QWidget):
 
         self.modal_extracting = BlockWindow(
             message='Внимание! Идет извлечение кадров.\nПожалуйста, не закрывайте программу.',
+            parent=self, progress=True
+        )
+        self.modal_thinning = BlockWindow(
+            message='Внимание! Идет удаление кадров.\nПожалуйста, не закрывайте программу.',
             parent=self
         )
         self.modal_grouping = BlockWindow(
@@ -203,6 +259,25 @@ class Window(QtWidgets.QWidget):
         self.extraction_process = QtCore.QProcess()
         self.extraction_process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
         self.extraction_process.finished.connect(self.on_extraction_finished)
+        self.extraction_process.readyReadStandardOutput.connect(self.on_extraction_output)
+        # Вывод wrapper.py: строки JSON - события прогресса, остальные строки сохраняются для сообщения об ошибке
+        self.extraction_buffer = b''
+        self.extraction_log = []
+
+        # Видеофайлы опрашиваются в пуле потоков, строки добавляются в таблицу по мере готовности.
+        # pending_probes - файлы, которые еще опрашиваются (повторно не ставятся в очередь),
+        # probe_generation отсекает результаты загрузок, отмененных пользователем.
+        self.probe_pool = QtCore.QThreadPool()
+        self.probe_pool.setMaxThreadCount(PROBE_WORKERS)
+        self.probe_signals = ProbeSignals()
+        self.probe_signals.probed.connect(self.on_probed)
+        self.probe_cancelled = threading.Event()
+        self.probe_generation = 0
+        self.pending_probes = set()
+
+        self.thinning_process = QtCore.QProcess()
+        self.thinning_process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
+        self.thinning_process.finished.connect(self.on_thinning_finished)
 
         self.groping_process = QtCore.QProcess()
         self.groping_process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
@@ -221,9 +296,42 @@ class Window(QtWidgets.QWidget):
             self.groping_process.start(str(PYTHON), [str(RENAMER), _dir])
 
 
+    @QtCore.pyqtSlot()
+    def on_extraction_output(self):
+        lines = (self.extraction_buffer + bytes(self.extraction_process.readAllStandardOutput())).split(b'\n')
+        self.extraction_buffer = lines.pop()
+        for line in lines:
+            line = line.decode('utf8', 'replace').strip()
+            if line.startswith('{'):
+                try:
+                    self.modal_extracting.set_progress(json.loads(line))
+                    continue
+                except (ValueError, KeyError, TypeError):
+                    pass
+            if line:
+                self.extraction_log.append(line)
+
     @QtCore.pyqtSlot()
     def on_extraction_finished(self):
+        self.on_extraction_output()
         self.modal_extracting.close()
+        if self.extraction_process.exitCode() != 0:
+            QtWidgets.QMessageBox.critical(
+                self, 'Ошибка', '\n'.join(self.extraction_log)[-2000:], QtWidgets.QMessageBox.Ok
+            )
+
+    @QtCore.pyqtSlot()
+    def on_thinning_finished(self):
+        self.modal_thinning.close()
+        # Из таблицы убираются строки удаленных кадров
+        for i in reversed(range(self.tv.table_sti.rowCount())):
+            if not Path(self.tv.table_sti.item(i, 0).data()).exists():
+                self.tv.table_sti.removeRow(i)
+        if self.thinning_process.exitCode() != 0:
+            QtWidgets.QMessageBox.critical(
+                self, 'Ошибка', bytes(self.thinning_process.readAll()).decode('utf8', 'replace')[-2000:],
+                QtWidgets.QMessageBox.Ok
+            )
 
     @QtCore.pyqtSlot()
     def on_grouping_finished(self):
@@ -288,10 +396,14 @@ class Window(QtWidgets.QWidget):
                         '--input', *files,
                         '--output', str(self.output),
                         'extract',
+                        '--progress', 'json',
                     ]
                     params = self.get_parameters()
                     if params is not None:
                         args.extend(params)
+                    self.extraction_buffer = b''
+                    self.extraction_log = []
+                    self.modal_extracting.reset_progress(len(files))
                     self.modal_extracting.show()
 
                     # sp.run(cmd)
@@ -322,8 +434,45 @@ class Window(QtWidgets.QWidget):
             if _f.is_file():
                 self.last_pwd = _f.parent
 
-        for f in natsorted(set(files) - set(self.tv.table_sti.item(i, 0).data() for i in range(self.tv.table_sti.rowCount()))):
-            self.tv.append_to_table(f)
+        loaded = set(self.tv.table_sti.item(i, 0).data() for i in range(self.tv.table_sti.rowCount()))
+        files = [f for f in natsorted(set(files)) if str(f) not in loaded and f not in self.pending_probes]
+        if not files:
+            return
+
+        if not self.pending_probes:
+            self.probe_progress.setRange(0, 0)
+            self.probe_progress.setValue(0)
+        self.pending_probes.update(files)
+        self.probe_progress.setMaximum(self.probe_progress.maximum() + len(files))
+        self.probe_progress.show()
+        self.cancel_probe_btn.show()
+        for f in files:
+            self.probe_pool.start(ProbeWorker(f, self.probe_generation, self.probe_signals, self.probe_cancelled))
+
+    @QtCore.pyqtSlot(object, object, int)
+    def on_probed(self, path, info, generation):
+        if generation != self.probe_generation:
+            return
+        self.pending_probes.discard(path)
+        if self.tv.mode == 1 and info is not None:
+            self.tv.append_to_table(path, info)
+        self.probe_progress.setValue(self.probe_progress.value() + 1)
+        if not self.pending_probes:
+            self.reset_probe_progress()
+
+    @QtCore.pyqtSlot()
+    def on_cancel_probe(self):
+        # Задачи из очереди снимаются, уже запущенные завершаются, но их результаты отбрасываются
+        self.probe_pool.clear()
+        self.probe_cancelled.set()
+        self.probe_cancelled = threading.Event()
+        self.probe_generation += 1
+        self.pending_probes.clear()
+        self.reset_probe_progress()
+
+    def reset_probe_progress(self):
+        self.probe_progress.hide()
+        self.cancel_probe_btn.hide()
 
     @QtCore.pyqtSlot()
     def on_load_frames(self):
@@ -335,6 +484,7 @@ class Window(QtWidgets.QWidget):
 
         if files:
             if self.tv.mode == 1:
+                self.on_cancel_probe()
                 self.tv.table_sti.clear()
             self.tv.mode = 2
             self.tv.names_sti = ["Frames", 'TYPE', "MODE", 'WIDTH', 'HEIGHT']
@@ -346,6 +496,38 @@ class Window(QtWidgets.QWidget):
         for f in natsorted(set(files) - set(self.tv.table_sti.item(i, 0).data() for i in range(self.tv.table_sti.rowCount()))):
             self.tv.append_to_table(f)
 
+    @QtCore.pyqtSlot()
+    def on_thin_frames(self):
+        if self.tv.mode != 2 or self.tv.table_sti.rowCount() == 0:
+            QtWidgets.QMessageBox.critical(
+                self, 'Список файлов пуст!',
+                "Не указаны кадры для удаления. Добавьте кадры!",
+                QtWidgets.QMessageBox.Ok
+            )
+            return
+
+        files = [self.tv.table_sti.item(i, 0).data() for i in range(self.tv.table_sti.rowCount())]
+        n = self.frames_field.value()
+        keep_ratio = '{}/{}'.format(n - 1, n)
+        # План строится заранее (без удаления), чтобы пользователь подтвердил количество удаляемых кадров
+        plan = make_plan(map(Path, files), keep_ratio)
+        deleted = sum(len(item.delete) for item in plan)
+        answer = QtWidgets.QMessageBox.question(
+            self, 'Удаление кадров',
+            'Будет удалено {} из {} кадров. Продолжить?'.format(deleted, len(files)),
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No
+        )
+        if answer != QtWidgets.QMessageBox.Yes:
+            return
+
+        # Подпроцесс удаляет подтвержденный план: список кадров передается через стандартный ввод (в командной
+        # строке он может не поместиться), а директории плана ограничивают, где удаление разрешено
+        self.modal_thinning.show()
+        self.thinning_process.start(str(PYTHON), [str(WRAPPER), '--input', *[str(item.directory) for item in plan],
+                                                  'thin', '--delete_from', '-'])
+        self.thinning_process.write(b''.join(os.fsencode(str(path)) + b'\n' for item in plan for path in item.delete))
+        self.thinning_process.closeWriteChannel()
+
     def keyPressEvent(self, QKeyEvent):
         actions = {
             QtCore.Qt.Key_Escape: self.close